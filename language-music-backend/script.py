@@ -1,24 +1,36 @@
 import json
 import os.path
+from contextlib import nullcontext
+from typing import List, Optional
 
+import pydub
 import typer
 
 from src import firestore
+from src.dictionary import compile_dictionary
 from src.genius import get_song_url, get_lyrics
 from src.players import spotify, youtube
 from src.players.utils import convert_id
 from src.processing import SongProcessor
 from src.schemas.song import SongWithLanguage
+from src.sound.models import warm_up_models
 from src.sound.process import process
-from src.sound.utils import TRANSCRIPTION_FILE_NAME
+from src.sound.profiling import aggregate_profiles
+from src.sound.silence import benchmark_silence_detection
+from src.sound.worker import run_sound_worker
+from src.sound.utils import TRANSCRIPTION_FILE_NAME, LRC_FILE_NAME
+from src.sync.batch import find_transcribed_songs, sync_all_songs, sync_song_lyrics
+from src.sync.instrumentation import collect_sync_stats
+from src.sync.benchmark import (
+    benchmark_tokenization,
+    benchmark_corpus,
+    compare_benchmarks,
+)
 from src.sync import (
     search_for_segment,
     read_toy_lyrics_data,
     extract_known_passages,
     print_sync_stats_debug,
-    clean_lyrics,
-    sync_words,
-    lrc,
 )
 
 app = typer.Typer()
@@ -33,6 +45,21 @@ def read_dictionary_file(dictionary_file: str):
     print(words[:10])
 
 
+@app.command()
+def build_dictionaries(languages: List[str] = typer.Argument(None)):
+    """
+    Compile the dictionaries into the memory-mapped format, all of them by default
+    """
+    for language in languages or ["de", "en", "es", "fr", "sv"]:
+        try:
+            path = compile_dictionary(language)
+        except FileNotFoundError as e:
+            print(f"Skipping {language}: {e}")
+            continue
+
+        print(f"Compiled {language} dictionary to {path}")
+
+
 @app.command()
 def publish_processed_song(firestore_id: str):
     print("Publishing processed song...")
@@ -55,6 +82,37 @@ def publish_processed_song(firestore_id: str):
     db.collection("songs").document(firestore_id).set(processed_song.model_dump())
 
 
+@app.command()
+def publish_song_variants(
+    firestore_id: str, count: int = 5, word_selection_tasks: int = 3
+):
+    """
+    Store `count` exercise variants of the song in its `variants` subcollection, replacing the previous ones
+    """
+    db = firestore.init_firestore()
+    song_reference = db.collection("songs").document(firestore_id)
+
+    song: SongWithLanguage = SongWithLanguage(**song_reference.get().to_dict())
+    variants = SongProcessor(song).create_variants(
+        count, word_selection_tasks=word_selection_tasks
+    )
+
+    variants_collection = song_reference.collection("variants")
+    writes = [
+        (variants_collection.document(str(index)), variant.model_dump())
+        for index, variant in enumerate(variants)
+    ]
+    # The variants of an earlier run with a larger count
+    writes += [
+        (reference, None)
+        for reference in variants_collection.list_documents()
+        if not (reference.id.isdigit() and int(reference.id) < len(variants))
+    ]
+    firestore.write_in_batches(db, writes)
+
+    print(f"Published {len(variants)} variants of {firestore_id}")
+
+
 @app.command()
 def get_youtube_id(spotify_id: str):
     spotify_client = spotify.SpotifyClient()
@@ -148,12 +206,176 @@ def find_all_relevant_segments():
 
 
 @app.command()
-def separate_vocals(youtube_id: str, language: str):
-    process(youtube_id, language)
+def benchmark_sync_tokenization(
+    fixture_dir: str = "test/data/sync/dom_andra", repeat: int = 10
+):
+    result = benchmark_tokenization(fixture_dir, repeat=repeat)
+
+    print(f"Re-splitting lyrics: {result['retokenizing_seconds'] * 1000:.1f} ms / run")
+    print(f"Tokenized once: {result['tokenized_seconds'] * 1000:.1f} ms / run")
+    print(f"Speedup: {result['speedup']:.1f}x")
+
+
+@app.command()
+def benchmark_sync(
+    fixtures_dir: str = "test/data/sync",
+    output: str = "bench_sync.json",
+    mode: str = "greedy",
+    repeat: int = 3,
+    baseline: Optional[str] = None,
+):
+    result = benchmark_corpus(fixtures_dir, mode=mode, repeat=repeat)
+
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    for song in result["songs"]:
+        print(
+            f"{song['song']}: {song['seconds'] * 1000:.1f} ms, "
+            f"{song['fuzzy_match_calls']} fuzzy matches, "
+            f"covered up to {song['last_covered_index']} / {song['total_words']}, "
+            f"max gap {song['max_gap']}, {song['missed_segments']} missed segments"
+        )
+    print(f"Total: {result['total_seconds'] * 1000:.1f} ms, written to {output}")
+
+    if baseline:
+        with open(baseline, "r") as f:
+            baseline_result = json.load(f)
+
+        for change in compare_benchmarks(result, baseline_result):
+            print(
+                f"{change['song']}: {change['seconds_ratio']:.2f}x time, "
+                f"{change['fuzzy_match_calls_delta']:+} fuzzy matches, "
+                f"{change['max_gap_delta']:+} max gap, "
+                f"{change['missed_segments_delta']:+} missed segments"
+            )
+
+
+@app.command()
+def separate_vocals(
+    youtube_id: str,
+    language: str,
+    streaming: bool = False,
+    transcription_workers: int = 1,
+    in_memory: bool = False,
+    debug_files: bool = False,
+    force: bool = False,
+    pipe_decoding: bool = False,
+    vocal_activity: bool = False,
+):
+    process(
+        youtube_id,
+        language,
+        streaming_separation=streaming,
+        transcription_workers=transcription_workers,
+        in_memory=in_memory,
+        debug_files=debug_files,
+        force=force,
+        pipe_decoding=pipe_decoding,
+        vocal_activity=vocal_activity,
+    )
+
+
+@app.command()
+def separate_all_vocals(language: str, youtube_ids: List[str]):
+    """
+    Process several songs in a row, loading the models once
+    """
+    warm_up_models()
+    for youtube_id in youtube_ids:
+        process(youtube_id, language)
+
+
+@app.command()
+def sound_worker(
+    queue_file: str,
+    follow: bool = False,
+    max_songs_in_flight: int = 4,
+    download_workers: int = 2,
+    separation_workers: int = 1,
+    transcription_workers: int = 1,
+    in_memory: bool = False,
+    pipe_decoding: bool = False,
+    vocal_activity: bool = False,
+):
+    """
+    Process the songs of a JSONL queue, one {"youtube_id": ..., "language": ...} per line, overlapping the stages of
+    different songs. With --follow, keep waiting for new lines.
+    """
+    warm_up_models()
+    results = run_sound_worker(
+        queue_file,
+        follow=follow,
+        stage_concurrency={
+            "download": download_workers,
+            "extract_voice": separation_workers,
+            "in_memory": separation_workers,
+        },
+        max_songs_in_flight=max_songs_in_flight,
+        transcription_workers=transcription_workers,
+        in_memory=in_memory,
+        pipe_decoding=pipe_decoding,
+        vocal_activity=vocal_activity,
+    )
+
+    failed = [result for result in results if result["status"] != "ok"]
+    print(f"Processed {len(results) - len(failed)} songs, {len(failed)} failed")
+    for result in failed:
+        print(f"{result['youtube_id']} ({result['stage']}): {result['error']}")
+
+
+@app.command()
+def profile_report(songs_dir: str = "data/songs", output_file: Optional[str] = None):
+    """
+    Summarize the stage profiles of the processed songs, to see which stage dominates and how to size the workers
+    """
+    report = aggregate_profiles(songs_dir)
+    if output_file:
+        with open(output_file, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print(
+        f"{report['songs']} songs, {report['audio_seconds'] / 60:.1f} minutes of audio"
+    )
+    for stage, summary in sorted(
+        report["stages"].items(), key=lambda item: -item[1]["wall_seconds"]
+    ):
+        real_time_factor = (
+            f"{summary['mean_real_time_factor']:.3f}"
+            if summary["mean_real_time_factor"] is not None
+            else "-"
+        )
+        print(
+            f"{stage}: {summary['songs']} songs, "
+            f"{summary['wall_share']:.0%} of the time, "
+            f"real-time factor {real_time_factor}, "
+            f"{summary['cpu_utilization']:.1f} CPUs, "
+            f"peak {summary['max_peak_rss_bytes'] / (1 << 20):.0f} MiB"
+        )
 
 
 @app.command()
-def sync_lyrics(song_id: str):
+def benchmark_silence(
+    audio_file: str, min_silence_len: int = 5000, silence_thresh: float = -32
+):
+    """
+    Compare the silence detection of the splits with the pydub implementation, on the vocals of a song for example
+    """
+    sound = pydub.AudioSegment.from_file(audio_file)
+    result = benchmark_silence_detection(
+        sound, min_silence_len=min_silence_len, silence_thresh=silence_thresh
+    )
+
+    print(f"pydub: {result['pydub_seconds']:.2f}s")
+    print(f"numpy: {result['numpy_seconds']:.3f}s")
+    print(f"Same ranges: {result['equivalent']}")
+    if not result["equivalent"]:
+        print(f"pydub ranges: {result['pydub_ranges']}")
+        print(f"numpy ranges: {result['numpy_ranges']}")
+
+
+@app.command()
+def sync_lyrics(song_id: str, instrument: bool = False):
     db = firestore.init_firestore()
     song_doc = db.collection("songs").document(song_id).get()
     if not song_doc.exists:
@@ -170,17 +392,48 @@ def sync_lyrics(song_id: str):
     ) as f:
         data = json.load(f)
 
-    lyrics_continuous = clean_lyrics(song.lyrics)
-    lyrics_with_new_lines = clean_lyrics(song.lyrics, keep_new_lines=True)
+    with collect_sync_stats(log=True, song_id=song_id) if instrument else nullcontext():
+        formatted_lrc = sync_song_lyrics(song.lyrics, data)
 
-    relevant_segments = data["segments"]
-    known_passages = extract_known_passages(relevant_segments, lyrics_continuous)
-    synced_words = sync_words(known_passages, data["segments"], lyrics_continuous)
+    with open(os.path.join(f"data/songs/", song.youtube_id, LRC_FILE_NAME), "w") as f:
+        f.write(formatted_lrc)
 
-    formatted_lrc = lrc.apply_formatting(lyrics_with_new_lines, synced_words)
 
-    with open(os.path.join(f"data/songs/", song.youtube_id, "lyrics.lrc"), "w") as f:
-        f.write(formatted_lrc)
+@app.command()
+def sync_all(
+    songs_dir: str = "data/songs",
+    workers: Optional[int] = None,
+    mode: str = "greedy",
+    instrument: bool = False,
+):
+    youtube_ids = find_transcribed_songs(songs_dir)
+    print(f"Found {len(youtube_ids)} transcribed songs")
+
+    # Firestore limits "in" queries to 30 values
+    db = firestore.init_firestore()
+    lyrics_by_song = {youtube_id: None for youtube_id in youtube_ids}
+    for i in range(0, len(youtube_ids), 30):
+        docs = (
+            db.collection("songs")
+            .where("youtube_id", "in", youtube_ids[i : i + 30])
+            .stream()
+        )
+        for doc in docs:
+            song = SongWithLanguage(**doc.to_dict())
+            lyrics_by_song[song.youtube_id] = song.lyrics
+
+    results = sync_all_songs(
+        lyrics_by_song, songs_dir, workers=workers, mode=mode, instrument=instrument
+    )
+
+    for result in sorted(results, key=lambda r: r["seconds"], reverse=True):
+        if result["status"] == "ok":
+            print(f"{result['youtube_id']}: {result['seconds']:.2f}s")
+        else:
+            print(f"{result['youtube_id']}: FAILED {result['error']}")
+
+    failures = [r for r in results if r["status"] != "ok"]
+    print(f"Synced {len(results) - len(failures)} songs, {len(failures)} failures")
 
 
 if __name__ == "__main__":
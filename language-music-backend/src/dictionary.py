@@ -1,9 +1,395 @@
-def load_dictionary_for_language(language: str) -> list[str]:
+import mmap
+import os
+import os.path
+import random
+import struct
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import Callable, Optional, Union
+
+import numpy as np
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
+from structlog import get_logger
+
+logger = get_logger()
+
+COMPILED_DICTIONARY_MAGIC = b"AHUMDIC2"
+_HEADER = struct.Struct("<8sII")
+
+
+class Dictionary(Sequence):
+    """
+    The words of a language, indexed for membership checks.
+
+    `word in dictionary` is a case-folded set lookup. Indexing and `len` expose the word list, so the dictionary can
+    still be sampled from.
+    """
+
+    def __init__(self, words: list[str]):
+        self.words = words
+        self.index = {word.casefold() for word in words}
+
+    def __contains__(self, word: object) -> bool:
+        return isinstance(word, str) and word.casefold() in self.index
+
+    def __getitem__(self, i):
+        return self.words[i]
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def estimated_bytes(self) -> int:
+        return (
+            sys.getsizeof(self.words)
+            + sum(sys.getsizeof(word) for word in self.words)
+            + sys.getsizeof(self.index)
+            + sum(sys.getsizeof(word) for word in self.index)
+        )
+
+
+class MappedDictionary(Sequence):
+    """
+    A dictionary compiled by `compile_dictionary`, memory-mapped instead of parsed.
+
+    The file is a sorted string table: a header with the number of words and the longest word, the offsets of the
+    words, an index of the words by length and the UTF-8 words themselves, sorted by their case-folded form. Nothing is
+    read until a word is looked up, and processes mapping the same file share it through the page cache. Membership is
+    a binary search, so it is case-insensitive like `Dictionary`.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, max_length = _HEADER.unpack_from(self.buffer)
+        if magic != COMPILED_DICTIONARY_MAGIC:
+            raise ValueError(f"Not a compiled dictionary: {path}")
+
+        self.offsets = np.frombuffer(
+            self.buffer, dtype="<u4", count=count + 1, offset=_HEADER.size
+        )
+        # The indexes of the words ordered by length, and where the words of each length start in that order
+        self.by_length = np.frombuffer(
+            self.buffer,
+            dtype="<u4",
+            count=count,
+            offset=_HEADER.size + self.offsets.nbytes,
+        )
+        self.length_starts = np.frombuffer(
+            self.buffer,
+            dtype="<u4",
+            count=max_length + 2,
+            offset=_HEADER.size + self.offsets.nbytes + self.by_length.nbytes,
+        )
+        self.words_start = (
+            _HEADER.size
+            + self.offsets.nbytes
+            + self.by_length.nbytes
+            + self.length_starts.nbytes
+        )
+
+    def __contains__(self, word: object) -> bool:
+        if not isinstance(word, str):
+            return False
+
+        key = word.casefold()
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self[middle].casefold() < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low < len(self) and self[low].casefold() == key
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("dictionary index out of range")
+
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.buffer[self.words_start + start : self.words_start + end].decode()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def words_of_length(self, length: int) -> list[str]:
+        """
+        :return: the words of `length` characters, decoded from the length index without scanning the other words
+        """
+        if not 0 <= length < len(self.length_starts) - 1:
+            return []
+
+        start, end = self.length_starts[length], self.length_starts[length + 1]
+        return [self[int(i)] for i in self.by_length[start:end]]
+
+    def estimated_bytes(self) -> int:
+        # The pages are shared with the other processes, but count them in full as they are resident once touched
+        return len(self.buffer)
+
+
+def _dictionary_source_file(language: str) -> tuple[str, str]:
     if language == "de":
-        with open(f"data/dictionaries/german.dic", "r", encoding="latin-1") as f:
-            words = f.read().splitlines()
+        return "data/dictionaries/german.dic", "latin-1"
     elif language in ["en", "es", "fr", "sv"]:
-        with open(f"data/dictionaries/{language}.txt", "r", encoding="utf-8") as f:
-            words = f.read().splitlines()
+        return f"data/dictionaries/{language}.txt", "utf-8"
+
+    raise ValueError(f"No dictionary for language: {language}")
+
+
+def compiled_dictionary_path(language: str) -> str:
+    return f"data/dictionaries/{language}.dict"
+
+
+def _read_dictionary_words(language: str) -> list[str]:
+    path, encoding = _dictionary_source_file(language)
+    with open(path, "r", encoding=encoding) as f:
+        words = f.read().splitlines()
 
     return words
+
+
+def write_compiled_dictionary(words: list[str], path: str):
+    """
+    Write the words in the format read by `MappedDictionary`
+    """
+    words = sorted(filter(None, words), key=str.casefold)
+    encoded = [word.encode() for word in words]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    np.cumsum([len(word) for word in encoded], out=offsets[1:])
+
+    lengths = np.array([len(word) for word in words], dtype=np.int64)
+    max_length = int(lengths.max(initial=0))
+    by_length = np.argsort(lengths, kind="stable").astype("<u4")
+    length_starts = np.zeros(max_length + 2, dtype="<u4")
+    np.cumsum(np.bincount(lengths, minlength=max_length + 1), out=length_starts[1:])
+
+    # Write to a temporary file first, processes might have the previous version mapped
+    with open(path + ".tmp", "wb") as f:
+        f.write(_HEADER.pack(COMPILED_DICTIONARY_MAGIC, len(encoded), max_length))
+        f.write(offsets.tobytes())
+        f.write(by_length.tobytes())
+        f.write(length_starts.tobytes())
+        f.write(b"".join(encoded))
+    os.replace(path + ".tmp", path)
+
+
+def compile_dictionary(language: str) -> str:
+    """
+    Compile the dictionary of a language, `load_dictionary_for_language` maps it from then on
+
+    :return: the path of the compiled dictionary
+    """
+    path = compiled_dictionary_path(language)
+    write_compiled_dictionary(_read_dictionary_words(language), path)
+
+    return path
+
+
+def _load_dictionary(language: str) -> Union[Dictionary, MappedDictionary]:
+    """
+    Maps the compiled dictionary when it is at least as recent as the source file, otherwise parses the source file.
+    """
+    source_path, _ = _dictionary_source_file(language)
+    compiled_path = compiled_dictionary_path(language)
+    if os.path.exists(compiled_path):
+        if not os.path.exists(source_path) or os.path.getmtime(
+            compiled_path
+        ) >= os.path.getmtime(source_path):
+            try:
+                return MappedDictionary(compiled_path)
+            except ValueError:
+                # Compiled with an older format
+                logger.warning(
+                    "Compiled dictionary format is outdated, ignoring it",
+                    language=language,
+                )
+        else:
+            logger.warning(
+                "Compiled dictionary is stale, ignoring it", language=language
+            )
+
+    return Dictionary(_read_dictionary_words(language))
+
+
+class NeighbourIndex:
+    """
+    The words of a dictionary bucketed by length, to find the words within a small edit distance of another one.
+
+    Words further than `max_distance` have a length difference of more than `max_distance`, so only the neighbouring
+    buckets are scanned, and the distances are computed in one rapidfuzz call per bucket.
+
+    The buckets of a mapped dictionary are decoded from its length index the first time a neighbouring length is
+    looked up, so only the lengths actually requested become resident in the process.
+    """
+
+    def __init__(self, words: Sequence[str]):
+        self.words = words
+        self.buckets: dict[int, list[str]] = {}
+        self.lock = threading.Lock()
+        self.resident_bytes = 0
+
+        if not isinstance(words, MappedDictionary):
+            for word in words:
+                self.buckets.setdefault(len(word), []).append(word)
+            # The words are only shared with an in-memory dictionary
+            owns_words = not isinstance(words, Dictionary)
+            self.resident_bytes = sum(
+                self._bucket_bytes(bucket, owns_words)
+                for bucket in self.buckets.values()
+            )
+
+    @staticmethod
+    def _bucket_bytes(bucket: list[str], owns_words: bool) -> int:
+        return sys.getsizeof(bucket) + (
+            sum(sys.getsizeof(word) for word in bucket) if owns_words else 0
+        )
+
+    def bucket(self, length: int) -> list[str]:
+        if length in self.buckets or not isinstance(self.words, MappedDictionary):
+            return self.buckets.get(length, [])
+
+        with self.lock:
+            if length not in self.buckets:
+                bucket = self.words.words_of_length(length)
+                self.buckets[length] = bucket
+                self.resident_bytes += self._bucket_bytes(bucket, True)
+
+            return self.buckets[length]
+
+    def estimated_bytes(self) -> int:
+        """
+        The memory of the buckets decoded so far, it grows as more lengths are looked up in a mapped dictionary
+        """
+        return self.resident_bytes
+
+    def neighbours(self, word: str, max_distance: int = 2) -> list[str]:
+        """
+        :return: the words within `max_distance` of `word`, other than `word` itself in any casing
+        """
+        return [
+            candidate
+            for length in range(len(word) - max_distance, len(word) + max_distance + 1)
+            for candidate, _, _ in process.extract(
+                word,
+                self.bucket(length),
+                scorer=Levenshtein.distance,
+                score_cutoff=max_distance,
+                limit=None,
+            )
+            if candidate.lower() != word.lower()
+        ]
+
+    def sample_neighbours(
+        self, word: str, count: int, max_distance: int = 2
+    ) -> list[str]:
+        """
+        :return: up to `count` random words within `max_distance` of `word`
+        """
+        neighbours = self.neighbours(word, max_distance=max_distance)
+        return random.sample(neighbours, min(count, len(neighbours)))
+
+
+class _CachedLanguage:
+    def __init__(self, dictionary: Union[Dictionary, MappedDictionary]):
+        self.dictionary = dictionary
+        self.neighbour_index: Optional[NeighbourIndex] = None
+        self.dictionary_bytes = dictionary.estimated_bytes()
+
+    def estimated_bytes(self) -> int:
+        if self.neighbour_index is None:
+            return self.dictionary_bytes
+
+        return self.dictionary_bytes + self.neighbour_index.estimated_bytes()
+
+
+class DictionaryCache:
+    """
+    The dictionaries of the process, loaded on demand by language.
+
+    Once the estimated size of the dictionaries and their neighbour indexes exceeds `max_bytes`, the least recently
+    used languages are dropped. The language just requested is always kept, even when it alone exceeds the budget. The
+    buckets a neighbour index decodes between two lookups of the cache are accounted for at the next one.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        loader: Callable[[str], Union[Dictionary, MappedDictionary]] = _load_dictionary,
+    ):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.languages: OrderedDict[str, _CachedLanguage] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def dictionary(self, language: str) -> Union[Dictionary, MappedDictionary]:
+        with self.lock:
+            return self._get(language).dictionary
+
+    def neighbour_index(self, language: str) -> NeighbourIndex:
+        with self.lock:
+            cached = self._get(language)
+            if cached.neighbour_index is None:
+                cached.neighbour_index = NeighbourIndex(cached.dictionary)
+                self._evict()
+
+            return cached.neighbour_index
+
+    def estimated_bytes(self) -> int:
+        return sum(cached.estimated_bytes() for cached in self.languages.values())
+
+    def clear(self):
+        with self.lock:
+            self.languages.clear()
+
+    def _get(self, language: str) -> _CachedLanguage:
+        if language in self.languages:
+            self.languages.move_to_end(language)
+        else:
+            self.languages[language] = _CachedLanguage(self.loader(language))
+            self._evict()
+
+        return self.languages[language]
+
+    def _evict(self):
+        while len(self.languages) > 1 and self.estimated_bytes() > self.max_bytes:
+            language, _ = self.languages.popitem(last=False)
+            logger.info("Evicted dictionary from cache", language=language)
+
+
+dictionary_cache = DictionaryCache(
+    int(os.environ.get("DICTIONARY_CACHE_MB", "512")) * 1024 * 1024
+)
+
+
+def configure_dictionary_cache(max_megabytes: int):
+    """
+    Change the memory budget of the dictionaries of the process, evicting dictionaries if needed
+    """
+    with dictionary_cache.lock:
+        dictionary_cache.max_bytes = max_megabytes * 1024 * 1024
+        dictionary_cache._evict()
+
+
+def load_dictionary_for_language(
+    language: str,
+) -> Union[Dictionary, MappedDictionary]:
+    """
+    Shared by every caller through `dictionary_cache`, treat it as read only
+    """
+    return dictionary_cache.dictionary(language)
+
+
+def load_neighbour_index(language: str) -> NeighbourIndex:
+    """
+    Built once per language from its dictionary, and evicted with it
+    """
+    return dictionary_cache.neighbour_index(language)
@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Optional
 
 import firebase_admin
 from firebase_admin import firestore
@@ -10,3 +11,27 @@ def init_firestore() -> firestore.firestore.Client:
     db = firestore.firestore.Client()
 
     return db
+
+
+# The most writes Firestore accepts in a single batch
+BATCH_WRITE_LIMIT = 500
+
+
+def write_in_batches(
+    db: firestore.firestore.Client,
+    writes: list[tuple[firestore.firestore.DocumentReference, Optional[dict]]],
+):
+    """
+    Commit the writes in batches of at most `BATCH_WRITE_LIMIT`. The batches are committed one after the other, so the
+    writes are only atomic within a batch.
+
+    :param writes: the documents to set, with their data, or to delete, with None
+    """
+    for start in range(0, len(writes), BATCH_WRITE_LIMIT):
+        batch = db.batch()
+        for reference, data in writes[start : start + BATCH_WRITE_LIMIT]:
+            if data is None:
+                batch.delete(reference)
+            else:
+                batch.set(reference, data)
+        batch.commit()
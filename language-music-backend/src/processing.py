@@ -2,56 +2,104 @@ import random
 import re
 from functools import wraps
 
-from Levenshtein import distance
-
-from src.dictionary import load_dictionary_for_language
+from src.dictionary import load_dictionary_for_language, load_neighbour_index
 from src.schemas.song import SongWithLanguage, ProcessedSong
 from src.schemas.tasks import WordSelectionTask, LineReorderingTask
 
 
-def requires_dictionary(func):
+def requires_words_from_lyrics(func):
     @wraps(func)
     def wrapper(self: "SongProcessor", *method_args, **method_kwargs):
-        if not self.dictionary:
-            self.dictionary = load_dictionary_for_language(self.song.language)
+        if not self.words_from_lyrics:
+            self.words_from_lyrics = self._extract_words_from_lyrics()
         return func(self, *method_args, **method_kwargs)
 
     return wrapper
 
 
-def requires_words_from_lyrics(func):
+def requires_oov_words(func):
     @wraps(func)
     def wrapper(self: "SongProcessor", *method_args, **method_kwargs):
-        if not self.words_from_lyrics:
-            self.words_from_lyrics = self._extract_words_from_lyrics()
+        if self.oov_words is None:
+            self.oov_words = self._find_oov_words()
         return func(self, *method_args, **method_kwargs)
 
     return wrapper
 
 
-def requires_oov_words(func):
+def requires_candidate_words(func):
     @wraps(func)
     def wrapper(self: "SongProcessor", *method_args, **method_kwargs):
-        if not self.oov_words:
-            self.oov_words = self._find_oov_words()
+        if self.candidate_words is None:
+            self.candidate_words = self._find_candidate_words()
+        return func(self, *method_args, **method_kwargs)
+
+    return wrapper
+
+
+def requires_line_oov_words(func):
+    @wraps(func)
+    def wrapper(self: "SongProcessor", *method_args, **method_kwargs):
+        if self.line_oov_words is None:
+            self.line_oov_words = self._find_line_oov_words()
         return func(self, *method_args, **method_kwargs)
 
     return wrapper
 
 
+def _mask(text: str, placeholder: str) -> str:
+    return "_" * (len(text) // 2) + placeholder + "_" * (len(text) // 2)
+
+
+def _compile_word_matcher(words: list[str]) -> re.Pattern:
+    """
+    Compile the words into a single regex, factored as a trie so that each position of the text is matched against
+    all the words at once. Where several words match at the same position, the longest one wins.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def to_pattern(node: dict) -> str:
+        branches = [
+            re.escape(char) + to_pattern(child) for char, child in node.items() if char
+        ]
+        if not branches:
+            return ""
+
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # Greedy, so a longer word is tried before stopping at a word ending here
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return re.compile(to_pattern(trie))
+
+
 class SongProcessor:
     def __init__(self, song: SongWithLanguage):
         self.song = song
         self.lyrics = song.lyrics
-        self.dictionary = None
         self.curated_lyrics = None
         self.words_from_lyrics = None
         self.oov_words = None
         self.processed_lyrics = None
 
+        # Kept up to date as tasks are added, so that adding a task does not scan the previous ones
+        self.candidate_words: set[str] = None
+        self.line_oov_words: dict[str, set[str]] = None
+        # The dictionary words close to each target word, shared by the variants of the song
+        self.neighbours: dict[str, list[str]] = {}
+
         self.word_selection_tasks: list[WordSelectionTask] = []
         self.line_reordering_tasks: list[LineReorderingTask] = []
 
+    @property
+    def dictionary(self):
+        # Not kept on the processor, the process-wide cache decides which dictionaries stay loaded
+        return load_dictionary_for_language(self.song.language)
+
     def _extract_words_from_lyrics(self):
         curated_lyrics = self.lyrics.replace("<br>", "\n").replace("<br/>", "\n")
 
@@ -76,33 +124,58 @@ class SongProcessor:
             if not word == "" and not word.isnumeric()
         ]
 
-    def _find_oov_words(self):
-        return [
+    def _find_oov_words(self) -> set[str]:
+        # The dictionary membership is case-folded, so it also covers the lowercase version of the word
+        dictionary = self.dictionary
+        return {word for word in self.words_from_lyrics if word not in dictionary}
+
+    def _find_candidate_words(self) -> set[str]:
+        """
+        The words that can still be the target of a word selection task
+        """
+        candidate_words = {
             word
             for word in self.words_from_lyrics
-            if (word not in self.dictionary and not word.lower() in self.dictionary)
-        ]
+            if len(word) >= 5 and word not in self.oov_words
+        }
+        for task in self.word_selection_tasks:
+            self._discard_overlapping_candidates(candidate_words, task.target_word)
+        for task in self.line_reordering_tasks:
+            candidate_words.difference_update(task.scrambled_line)
 
-    @requires_dictionary
-    @requires_words_from_lyrics
-    def create_word_selection_task(self, forced_word: str = None) -> "SongProcessor":
-        exclusion_list = (
-            self.oov_words
-            + [task.target_word for task in self.word_selection_tasks]
-            + [
-                word
-                for line_reordering_task in self.line_reordering_tasks
-                for word in line_reordering_task.scrambled_line
-            ]
-        )
+        return candidate_words
 
-        word_to_replace = random.choice(
+    @staticmethod
+    def _discard_overlapping_candidates(candidate_words: set[str], target_word: str):
+        """
+        Drop the target and the words containing it or contained in it: the masking matches the targets as substrings,
+        so a target nested in another one might never be masked on its own
+        """
+        candidate_words.difference_update(
             [
                 word
-                for word in set(self.words_from_lyrics)
-                if word not in exclusion_list and len(word) >= 5
+                for word in candidate_words
+                if word in target_word or target_word in word
             ]
         )
+
+    def _find_line_oov_words(self) -> dict[str, set[str]]:
+        """
+        The oov words appearing in each line, as substrings of the line
+        """
+        # Especially for french, after removing punctuation we are left of with 'j' and 'l'
+        oov_words = [oov_word for oov_word in self.oov_words if len(oov_word) >= 2]
+
+        return {
+            line: {oov_word for oov_word in oov_words if oov_word in line}
+            for line in {line.strip() for line in self.curated_lyrics.splitlines()}
+        }
+
+    @requires_words_from_lyrics
+    @requires_oov_words
+    @requires_candidate_words
+    def create_word_selection_task(self, forced_word: str = None) -> "SongProcessor":
+        word_to_replace = random.choice(list(self.candidate_words))
         if forced_word:
             word_to_replace = forced_word
 
@@ -110,18 +183,12 @@ class SongProcessor:
         print(word_to_replace)
 
         # Find 2 other words in the dictionary that are close to this one
-        alternatives = []
-
-        for word in random.sample(self.dictionary, len(self.dictionary)):
-            if word.lower() == word_to_replace.lower():
-                continue
-
-            current_distance = distance(word_to_replace, word)
-
-            if current_distance <= 2:
-                alternatives.append(word)
-                if len(alternatives) == 2:
-                    break
+        if word_to_replace not in self.neighbours:
+            self.neighbours[word_to_replace] = load_neighbour_index(
+                self.song.language
+            ).neighbours(word_to_replace, max_distance=2)
+        neighbours = self.neighbours[word_to_replace]
+        alternatives = random.sample(neighbours, min(2, len(neighbours)))
 
         alternatives.append(word_to_replace)
         new_task = WordSelectionTask(
@@ -130,6 +197,7 @@ class SongProcessor:
             alternatives=random.sample(alternatives, len(alternatives)),
         )
         self.word_selection_tasks.append(new_task)
+        self._discard_overlapping_candidates(self.candidate_words, word_to_replace)
 
         return self
 
@@ -152,21 +220,13 @@ class SongProcessor:
         return re.sub(r"\s+", " ", line_to_scramble)
 
     @requires_words_from_lyrics
-    @requires_dictionary
     @requires_oov_words
+    @requires_line_oov_words
     def create_line_reordering_task(self) -> "SongProcessor":
         all_lines = [line.strip() for line in self.curated_lyrics.splitlines()]
 
         # extract the lines containing no oov words
-        pure_lines = [
-            line
-            for line in all_lines
-            if not any(
-                # Especially for french, after removing punctuation we are left of with 'j' and 'l'
-                (len(oov_word) >= 2) and (oov_word in line)
-                for oov_word in self.oov_words
-            )
-        ]
+        pure_lines = [line for line in all_lines if not self.line_oov_words[line]]
 
         try:
             line_to_scramble = self._select_one_unique(pure_lines)
@@ -186,6 +246,8 @@ class SongProcessor:
             scrambled_line=scrambled_line.split(" "),
         )
         self.line_reordering_tasks.append(new_task)
+        if self.candidate_words is not None:
+            self.candidate_words.difference_update(new_task.scrambled_line)
 
         return self
 
@@ -196,51 +258,98 @@ class SongProcessor:
         self.processed_lyrics = processed_lyrics.strip()
         self.processed_lyrics = re.sub(r"\n{3,}", "\n\n", self.processed_lyrics)
 
-        processed_lines = self.processed_lyrics.splitlines()
-        processed_lines_original = processed_lines.copy()
+        line_tasks: dict[str, list[LineReorderingTask]] = {}
+        for task in self.line_reordering_tasks:
+            line_tasks.setdefault(task.original_line, []).append(task)
 
-        inserted_lines_count = 0
-        word_tasks_handled = []
-        for index, line in enumerate(processed_lines_original):
-            updated_line = line
+        word_tasks: dict[str, list[WordSelectionTask]] = {}
+        for task in self.word_selection_tasks:
+            word_tasks.setdefault(task.target_word, []).append(task)
+
+        word_matcher = _compile_word_matcher(list(word_tasks))
+        # Only forced targets can be nested, see `_discard_overlapping_candidates`
+        nested_targets = [
+            word
+            for word in word_tasks
+            if any(word != other and word in other for other in word_tasks)
+        ]
+
+        def mask_word(match: re.Match) -> str:
+            return _mask(match.group(), f"wp{word_tasks[match.group()][0].task_id}")
 
-            # only update the real insertion count after all tasks have been handled
-            lines_inserted_for_current_line = 0
-            for task in self.line_reordering_tasks:
-                if task.original_line == line:
-                    updated_line = (
-                        "_" * (len(line) // 2)
-                        + f"lp{task.task_id}"
-                        + "_" * (len(line) // 2)
-                    )
-                    processed_lines.insert(
-                        index + inserted_lines_count + 1,
-                        "__lrt{task_id}__".format(task_id=task.task_id),
-                    )
-                    lines_inserted_for_current_line += 1
-
-            for task in self.word_selection_tasks:
-                if task.target_word in line:
-                    updated_line = updated_line.replace(
-                        task.target_word,
-                        "_" * (len(task.target_word) // 2)
-                        + f"wp{task.task_id}"
-                        + "_" * (len(task.target_word) // 2),
-                    )
-                    if task.task_id not in word_tasks_handled:
-                        processed_lines.insert(
-                            index + inserted_lines_count + 1, f"__wst{task.task_id}__",
+        processed_lines = []
+        word_tasks_handled = set()
+        for line in self.processed_lyrics.splitlines():
+            updated_line = line
+            markers = []
+
+            for task in line_tasks.get(line, []):
+                updated_line = _mask(line, f"lp{task.task_id}")
+                markers.append(f"__lrt{task.task_id}__")
+
+            matched_words = set(word_matcher.findall(line)) if word_tasks else set()
+            # Where the longer target matches, the target nested in it does not, look for it as a substring instead
+            matched_words.update(word for word in nested_targets if word in line)
+            if matched_words:
+                if line not in line_tasks:
+                    updated_line = word_matcher.sub(mask_word, line)
+                    for word in nested_targets:
+                        updated_line = updated_line.replace(
+                            word, _mask(word, f"wp{word_tasks[word][0].task_id}")
                         )
-                        word_tasks_handled.append(task.task_id)
-                        lines_inserted_for_current_line += 1
 
-            processed_lines[index + inserted_lines_count] = updated_line
-            inserted_lines_count += lines_inserted_for_current_line
+                matched_task_ids = {
+                    task.task_id for word in matched_words for task in word_tasks[word]
+                }
+                for task_id in sorted(matched_task_ids - word_tasks_handled):
+                    markers.append(f"__wst{task_id}__")
+                word_tasks_handled |= matched_task_ids
+
+            processed_lines.append(updated_line)
+            # The markers of a line follow it, the last one added first
+            processed_lines.extend(reversed(markers))
 
         self.processed_lyrics = "\n".join(processed_lines)
 
         return self
 
+    def reset_tasks(self) -> "SongProcessor":
+        """
+        Drop the tasks and the masked lyrics, keeping everything derived from the lyrics and the dictionary
+        """
+        self.word_selection_tasks = []
+        self.line_reordering_tasks = []
+        self.candidate_words = None
+        self.processed_lyrics = None
+
+        return self
+
+    def create_variants(
+        self,
+        count: int,
+        line_reordering_tasks: int = 1,
+        word_selection_tasks: int = 3,
+    ) -> list[ProcessedSong]:
+        """
+        Generate independent exercises for the song. The curated lyrics, the oov words and the dictionary lookups are
+        computed once and shared by all the variants.
+
+        :param count: the number of variants
+        :param line_reordering_tasks: the number of line reordering tasks in each variant
+        :param word_selection_tasks: the number of word selection tasks in each variant
+        """
+        variants = []
+        for _ in range(count):
+            self.reset_tasks()
+            for _ in range(line_reordering_tasks):
+                self.create_line_reordering_task()
+            for _ in range(word_selection_tasks):
+                self.create_word_selection_task()
+
+            variants.append(self.mask_words_according_to_tasks().get_processed_song())
+
+        return variants
+
     def get_processed_song(self) -> ProcessedSong:
         return ProcessedSong(
             **{
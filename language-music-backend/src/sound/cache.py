@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import os.path
+from typing import Callable
+
+from structlog import get_logger
+
+logger = get_logger()
+
+MANIFEST_FILE_NAME = "manifest.json"
+
+# Bump the version of a stage when a change of its code changes its outputs
+STAGE_VERSIONS = {
+    "download": 1,
+    "convert": 1,
+    "extract_voice": 1,
+    "split": 1,
+    "transcribe": 1,
+    "in_memory": 1,
+}
+
+
+def hash_path(path: str) -> str:
+    """
+    The sha256 of the content of a file, or of the names and contents of the files in a directory
+    """
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            digest.update(name.encode())
+            digest.update(hash_path(os.path.join(path, name)).encode())
+        return digest.hexdigest()
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class StageCache:
+    """
+    Records in a manifest in the song directory the key each stage last ran with. The key covers the content of the
+    inputs of the stage, its parameters and its version, so that a stage is skipped only when it would produce the
+    same outputs again.
+
+    Stages feed each other through files, so changing a parameter of a stage re-runs it, and the stages after it run
+    again only if its outputs changed.
+    """
+
+    def __init__(self, working_dir: str, force: bool = False):
+        """
+        :param working_dir: the directory of the song
+        :param force: run every stage, still recording them in the manifest
+        """
+        self.working_dir = working_dir
+        self.force = force
+        self.manifest_path = os.path.join(working_dir, MANIFEST_FILE_NAME)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                self.manifest = json.load(f)
+
+    def key(self, stage: str, inputs: list[str], params: dict) -> str:
+        digest = hashlib.sha256()
+        digest.update(
+            json.dumps(
+                {"stage": stage, "version": STAGE_VERSIONS[stage], "params": params},
+                sort_keys=True,
+            ).encode()
+        )
+        for input_name in inputs:
+            digest.update(input_name.encode())
+            digest.update(
+                hash_path(os.path.join(self.working_dir, input_name)).encode()
+            )
+        return digest.hexdigest()
+
+    def _hash_outputs(self, outputs: list[str]) -> dict[str, str]:
+        return {
+            output: hash_path(os.path.join(self.working_dir, output))
+            for output in outputs
+        }
+
+    def is_fresh(self, stage: str, key: str, outputs: list[str]) -> bool:
+        """
+        Fresh when the stage last ran with the same key, and its outputs are still the ones it wrote: an output
+        truncated or changed since, by an interrupted run for example, runs the stage again
+        """
+        if self.force:
+            return False
+
+        recorded = self.manifest.get(stage, {})
+        if recorded.get("key") != key or not isinstance(recorded.get("outputs"), dict):
+            return False
+        if not all(
+            os.path.exists(os.path.join(self.working_dir, output)) for output in outputs
+        ):
+            return False
+
+        return recorded["outputs"] == self._hash_outputs(outputs)
+
+    def record(self, stage: str, key: str, outputs: list[str]):
+        self.manifest[stage] = {"key": key, "outputs": self._hash_outputs(outputs)}
+
+        # Write to a temporary file first, an interrupted run should never leave a truncated manifest behind
+        with open(self.manifest_path + ".tmp", "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+    def run(
+        self,
+        stage: str,
+        func: Callable[[], object],
+        inputs: list[str],
+        outputs: list[str],
+        params: dict,
+    ):
+        """
+        Run the stage unless its outputs are fresh
+
+        :param stage: the name of the stage, a key of `STAGE_VERSIONS`
+        :param func: runs the stage
+        :param inputs: the files or directories the stage reads, relative to the song directory
+        :param outputs: the files or directories the stage writes, relative to the song directory
+        :param params: everything else the outputs depend on, like the models and the thresholds
+        """
+        key = self.key(stage, inputs, params)
+        if self.is_fresh(stage, key, outputs):
+            logger.info("Skipping fresh stage", stage=stage)
+            return
+
+        func()
+        self.record(stage, key, outputs)
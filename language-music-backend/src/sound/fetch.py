@@ -1,8 +1,12 @@
 import subprocess
+import tempfile
+from typing import Iterator
 
 import pytube
 import os
 
+import numpy as np
+
 from src.sound.utils import ORIGINAL_FILE_NAME, CONVERTED_FILE_NAME
 from structlog import get_logger
 
@@ -41,3 +45,113 @@ def convert(target_location: str) -> str:
     subprocess.run(command, stdout=subprocess.PIPE, stdin=subprocess.PIPE)
 
     return output_file_name
+
+
+def __decode_command(
+    input_file_name: str, sample_rate: int, channels: int
+) -> list[str]:
+    return [
+        "ffmpeg",
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-i",
+        input_file_name,
+        "-ac",
+        str(channels),
+        "-ar",  # resampled by ffmpeg, instead of after loading
+        str(sample_rate),
+        "-f",  # raw little-endian 32-bit floats on stdout, no container
+        "f32le",
+        "pipe:1",
+    ]
+
+
+def decode(
+    input_file_name: str, sample_rate: int = 44100, channels: int = 2
+) -> np.ndarray:
+    """
+    Decode a song with ffmpeg straight into memory, without writing the converted file
+
+    :return: float samples between -1 and 1, shaped (frames, channels)
+    """
+    result = subprocess.run(
+        __decode_command(input_file_name, sample_rate, channels),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"ffmpeg could not decode {input_file_name}: {result.stderr.decode().strip()}"
+        )
+
+    return np.frombuffer(result.stdout, dtype="<f4").reshape((-1, channels))
+
+
+def stream_decoded(
+    input_file_name: str,
+    block_frames: int,
+    sample_rate: int = 44100,
+    channels: int = 2,
+) -> Iterator[np.ndarray]:
+    """
+    Same as `decode`, `block_frames` frames at a time, so that the whole song is never held in memory
+    """
+    # Not a pipe: ffmpeg logs an error per packet of a corrupt file, it would block once the pipe is full while we wait
+    # on stdout
+    stderr = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        __decode_command(input_file_name, sample_rate, channels),
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+    )
+    block_bytes = block_frames * channels * 4
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            # A short read only happens at the end of the stream, where it holds whole frames
+            yield np.frombuffer(data, dtype="<f4").reshape((-1, channels))
+
+        # The whole stream was read, ffmpeg has exited or is about to
+        returncode = process.wait()
+        stderr.seek(0)
+        errors = stderr.read().decode().strip()
+    finally:
+        if process.poll() is None:
+            # The consumer stopped early or failed, kill ffmpeg before closing the pipe it may be writing to
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        stderr.close()
+
+    # Only once the stream was read to its end, an early exit must not hide the error that caused it
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg could not decode {input_file_name}: {errors}")
+
+
+def probe_duration(input_file_name: str) -> float:
+    """
+    :return: the duration of the song in seconds, as read by ffprobe from the container
+    """
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-loglevel",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            input_file_name,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"ffprobe could not read {input_file_name}: {result.stderr.decode().strip()}"
+        )
+
+    return float(result.stdout)
@@ -0,0 +1,48 @@
+import time
+from functools import lru_cache
+
+import torch
+import whisper_timestamped as whisper
+from structlog import get_logger
+from torchaudio.pipelines import HDEMUCS_HIGH_MUSDB_PLUS
+
+logger = get_logger()
+
+SEPARATION_MODEL_NAME = "HDEMUCS_HIGH_MUSDB_PLUS"
+SEPARATION_SAMPLE_RATE = HDEMUCS_HIGH_MUSDB_PLUS.sample_rate
+WHISPER_MODEL_NAME = "openai/whisper-medium"
+
+
+@lru_cache()
+def get_separation_model():
+    """
+    The HDemucs model separating the vocals, loaded once per process and shared by every song
+    """
+    start = time.perf_counter()
+    model = HDEMUCS_HIGH_MUSDB_PLUS.get_model()
+    model.to(torch.device("cpu"))
+    logger.info("Separation model loaded", seconds=time.perf_counter() - start)
+
+    return model
+
+
+@lru_cache()
+def get_transcription_model(name: str = WHISPER_MODEL_NAME):
+    """
+    The whisper model, loaded once per process and shared by every song
+    """
+    start = time.perf_counter()
+    model = whisper.load_model(name)
+    logger.info(
+        "Transcription model loaded", name=name, seconds=time.perf_counter() - start
+    )
+
+    return model
+
+
+def warm_up_models():
+    """
+    Load the models up front, so that the first song does not pay for it
+    """
+    get_separation_model()
+    get_transcription_model()
@@ -1,26 +1,273 @@
-from src.sound.fetch import download, convert
-from src.sound.separation import extract_voice, split
-from src.sound.transcription import transcribe
+import json
+import os.path
+from typing import Callable
 
+import torch
+import torchaudio
 
-def process(youtube_id: str, language: str):
+from src.sound.cache import StageCache
+from src.sound.fetch import download, convert, decode, probe_duration
+from src.sound.models import (
+    WHISPER_MODEL_NAME,
+    SEPARATION_MODEL_NAME,
+    SEPARATION_SAMPLE_RATE,
+)
+from src.sound.profiling import StageProfiler
+from src.sound.separation import (
+    extract_voice,
+    split,
+    separate_vocals,
+    split_vocals,
+    write_splits,
+    SEPARATION_SEGMENT_SECONDS,
+    SEPARATION_OVERLAP,
+    SEPARATION_BATCH_SIZE,
+)
+from src.sound.transcription import transcribe, transcribe_chunks, to_whisper_audio
+from src.sound.utils import (
+    ORIGINAL_FILE_NAME,
+    CONVERTED_FILE_NAME,
+    VOCALS_FILE_NAME,
+    SPLITS_DIR_NAME,
+    SPLITS_PADDING,
+    TRANSCRIPTION_FILE_NAME,
+    convert_from_numpy,
+)
+from src.sound.vad import refine_chunks
+
+
+def process(
+    youtube_id: str,
+    language: str,
+    streaming_separation: bool = False,
+    transcription_workers: int = 1,
+    in_memory: bool = False,
+    debug_files: bool = False,
+    min_silence_len: int = 5000,
+    silence_thresh: float = -32,
+    force: bool = False,
+    pipe_decoding: bool = False,
+    vocal_activity: bool = False,
+):
     """
     Applies all the processing necessary to go from a song id on youtube to the synchronized lyrics
 
-    All the intermediate files (including the final transcriptions) are stored in local storage.
+    All the intermediate files (including the final transcriptions) are stored in local storage. The stages whose
+    inputs and parameters did not change since the last run are skipped, see `StageCache`. The stages that run are
+    profiled in a `profile.json`, see `StageProfiler`.
 
     :param youtube_id: the song id on youtube
     :param language:  the language of the lyrics
+    :param streaming_separation: separate the vocals chunk by chunk, to bound the memory used by long songs
+    :param transcription_workers: the number of splits transcribed in parallel, each worker loads its own model
+    :param in_memory: hand the audio from one stage to the next in memory, only the transcription is stored. Raises
+        a `ValueError` with `streaming_separation`.
+    :param debug_files: with `in_memory`, still store the vocals and the splits
+    :param min_silence_len: the shortest silence, in milliseconds, the vocals are split on
+    :param silence_thresh: the loudness, in dBFS, under which the vocals are silent
+    :param force: run all the stages, even the fresh ones
+    :param pipe_decoding: skip the conversion, the separation decodes the download with ffmpeg straight into memory
+    :param vocal_activity: transcribe only the parts of the splits where someone sings, see `refine_chunks`
     :return:
     """
+    for _, run_stage in plan_stages(
+        youtube_id,
+        language,
+        streaming_separation=streaming_separation,
+        transcription_workers=transcription_workers,
+        in_memory=in_memory,
+        debug_files=debug_files,
+        min_silence_len=min_silence_len,
+        silence_thresh=silence_thresh,
+        force=force,
+        pipe_decoding=pipe_decoding,
+        vocal_activity=vocal_activity,
+    ):
+        run_stage()
+
+
+def plan_stages(
+    youtube_id: str,
+    language: str,
+    streaming_separation: bool = False,
+    transcription_workers: int = 1,
+    in_memory: bool = False,
+    debug_files: bool = False,
+    min_silence_len: int = 5000,
+    silence_thresh: float = -32,
+    force: bool = False,
+    pipe_decoding: bool = False,
+    vocal_activity: bool = False,
+) -> list[tuple[str, Callable[[], None]]]:
+    """
+    The stages of `process`, to run one after the other: the name of each stage, and a function running it unless it
+    is fresh. See `process` for the parameters.
+    """
+    if in_memory and streaming_separation:
+        # The in-memory mode holds the whole song and its sources, the opposite of what streaming is asked for
+        raise ValueError("The in-memory mode does not support streaming separation")
+
     working_dir = f"data/songs/{youtube_id}"
+    cache = StageCache(working_dir, force=force)
+    profiler = StageProfiler(
+        working_dir,
+        audio_seconds=lambda: probe_duration(
+            os.path.join(working_dir, ORIGINAL_FILE_NAME)
+        ),
+    )
+
+    separation_params = {
+        "model": SEPARATION_MODEL_NAME,
+        "segment": SEPARATION_SEGMENT_SECONDS,
+        "overlap": SEPARATION_OVERLAP,
+        # The streaming separation normalizes with statistics computed in another precision, and does not batch
+        "streaming": streaming_separation,
+        "batch_size": None if streaming_separation else SEPARATION_BATCH_SIZE,
+    }
+    split_params = {
+        "min_silence_len": min_silence_len,
+        "silence_thresh": silence_thresh,
+        "padding": SPLITS_PADDING,
+    }
+    if vocal_activity:
+        split_params["vocal_activity"] = True
+    transcription_params = {"model": WHISPER_MODEL_NAME, "language": language}
+
+    def stage(name: str, func: Callable[[], object], **cache_args):
+        return name, lambda: cache.run(
+            name, lambda: profiler.run(name, func), **cache_args
+        )
+
+    stages = [
+        stage(
+            "download",
+            lambda: download(working_dir),
+            inputs=[],
+            outputs=[ORIGINAL_FILE_NAME],
+            params={"youtube_id": youtube_id},
+        ),
+    ]
+
+    if pipe_decoding:
+        # No converted file, the separation decodes the download itself
+        song_file = ORIGINAL_FILE_NAME
+        separation_params["decoding"] = "pipe"
+    else:
+        song_file = CONVERTED_FILE_NAME
+        stages.append(
+            stage(
+                "convert",
+                lambda: convert(working_dir),
+                inputs=[ORIGINAL_FILE_NAME],
+                outputs=[CONVERTED_FILE_NAME],
+                params={"channels": 2, "sample_rate": 44100},
+            )
+        )
+
+    if in_memory:
+        return stages + [
+            stage(
+                "in_memory",
+                lambda: __process_in_memory(
+                    working_dir,
+                    language,
+                    transcription_workers,
+                    debug_files,
+                    min_silence_len,
+                    silence_thresh,
+                    pipe_decoding,
+                    vocal_activity,
+                ),
+                inputs=[song_file],
+                outputs=[TRANSCRIPTION_FILE_NAME],
+                # Namespaced, the separation and the transcription both have a model
+                params={
+                    "separation": separation_params,
+                    "split": split_params,
+                    "transcription": transcription_params,
+                },
+            )
+        ]
 
-    download(working_dir)
+    return stages + [
+        stage(
+            "extract_voice",
+            lambda: extract_voice(
+                working_dir,
+                streaming=streaming_separation,
+                pipe_decoding=pipe_decoding,
+            ),
+            inputs=[song_file],
+            outputs=[VOCALS_FILE_NAME],
+            params=separation_params,
+        ),
+        stage(
+            "split",
+            lambda: split(
+                working_dir,
+                min_silence_len=min_silence_len,
+                silence_thresh=silence_thresh,
+                vocal_activity=vocal_activity,
+            ),
+            inputs=[VOCALS_FILE_NAME],
+            outputs=[SPLITS_DIR_NAME],
+            params=split_params,
+        ),
+        stage(
+            "transcribe",
+            lambda: transcribe(working_dir, language, workers=transcription_workers),
+            inputs=[SPLITS_DIR_NAME],
+            outputs=[TRANSCRIPTION_FILE_NAME],
+            params=transcription_params,
+        ),
+    ]
 
-    convert(working_dir)
 
-    extract_voice(working_dir)
+def __process_in_memory(
+    working_dir: str,
+    language: str,
+    transcription_workers: int,
+    debug_files: bool,
+    min_silence_len: int,
+    silence_thresh: float,
+    pipe_decoding: bool,
+    vocal_activity: bool,
+):
+    if pipe_decoding:
+        waveform = torch.from_numpy(
+            decode(
+                os.path.join(working_dir, ORIGINAL_FILE_NAME),
+                sample_rate=SEPARATION_SAMPLE_RATE,
+            ).T.copy()
+        )
+        sample_rate = SEPARATION_SAMPLE_RATE
+    else:
+        waveform, sample_rate = torchaudio.load(
+            os.path.join(working_dir, CONVERTED_FILE_NAME)
+        )
+    vocals, sample_rate = separate_vocals(waveform, sample_rate)
+    if debug_files:
+        torchaudio.save(
+            os.path.join(working_dir, VOCALS_FILE_NAME), vocals, sample_rate
+        )
 
-    split(working_dir)
+    chunks, chunk_timestamps = split_vocals(
+        convert_from_numpy(vocals.T.numpy(), sample_rate),
+        min_silence_len=min_silence_len,
+        silence_thresh=silence_thresh,
+    )
+    if vocal_activity:
+        chunks, chunk_timestamps = refine_chunks(chunks, chunk_timestamps)
+    if debug_files:
+        write_splits(working_dir, chunks, chunk_timestamps)
 
-    transcribe(working_dir, language)
+    transcription = transcribe_chunks(
+        [
+            (to_whisper_audio(chunk), start / 1000)
+            for chunk, (start, _) in zip(chunks, chunk_timestamps)
+        ],
+        language,
+        workers=transcription_workers,
+    )
+    with open(os.path.join(working_dir, TRANSCRIPTION_FILE_NAME), "w") as f:
+        json.dump(transcription, f)
@@ -0,0 +1,177 @@
+import glob
+import json
+import os
+import os.path
+import resource
+import sys
+import time
+from typing import Callable, Optional
+
+from structlog import get_logger
+
+logger = get_logger()
+
+PROFILE_FILE_NAME = "profile.json"
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the peak resident memory of the process to its current resident memory, Linux only
+
+    :return: whether the peak was reset. When it was not, the peak is the one of the whole life of the process.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+def peak_rss_bytes() -> int:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    # Without /proc, as on macOS, where ru_maxrss is in bytes. Linux counts it in kilobytes.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak * 1024 if sys.platform.startswith("linux") else peak
+
+
+def _cpu_seconds() -> float:
+    # The children count once they are waited for. The transcription workers live as long as the process, their CPU
+    # time is not charged to the stages.
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class StageProfiler:
+    """
+    Measures the stages of a song as they run, and keeps the last measure of each stage in a `profile.json` in the song
+    directory.
+
+    The measures are those of the whole process: when the stages of several songs run at once, as in `SoundWorker`,
+    each stage is charged for the others running alongside it.
+    """
+
+    def __init__(
+        self,
+        working_dir: str,
+        audio_seconds: Optional[Callable[[], Optional[float]]] = None,
+    ):
+        """
+        :param working_dir: the directory of the song
+        :param audio_seconds: returns the duration of the song, or None while it is unknown. Called after each stage
+            until it returns a duration.
+        """
+        self.working_dir = working_dir
+        self.path = os.path.join(working_dir, PROFILE_FILE_NAME)
+        self.audio_seconds_of_song = audio_seconds
+        self.profile = {"audio_seconds": None, "stages": {}}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.profile = json.load(f)
+
+    def audio_seconds(self) -> Optional[float]:
+        if self.profile["audio_seconds"] is None and self.audio_seconds_of_song:
+            try:
+                self.profile["audio_seconds"] = self.audio_seconds_of_song()
+            except Exception as e:
+                logger.warning("Could not measure the song duration", error=repr(e))
+
+        return self.profile["audio_seconds"]
+
+    def run(self, stage: str, func: Callable[[], object]):
+        """
+        Run the stage and record its wall time, CPU time, peak memory and real-time factor. A stage that fails is not
+        recorded.
+        """
+        peak_rss_reset = reset_peak_rss()
+        start_cpu = _cpu_seconds()
+        start = time.perf_counter()
+
+        func()
+
+        wall_seconds = time.perf_counter() - start
+        audio_seconds = self.audio_seconds()
+        measure = {
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": _cpu_seconds() - start_cpu,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "peak_rss_reset": peak_rss_reset,
+            # Below 1 the stage runs faster than the song plays
+            "real_time_factor": wall_seconds / audio_seconds if audio_seconds else None,
+        }
+        logger.info("Stage profiled", stage=stage, **measure)
+
+        self.profile["stages"][stage] = measure
+        # Write to a temporary file first, an interrupted run should never leave a truncated profile behind
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.profile, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def aggregate_profiles(songs_dir: str = "data/songs") -> dict:
+    """
+    Summarize the profiles of the songs in `songs_dir`, stage by stage
+
+    :return: the number of songs and seconds of audio profiled, and for each stage: the number of songs, the share of
+        the total wall time, the mean and maximum real-time factor, the CPU seconds per wall second and the largest
+        peak memory
+    """
+    profiles = []
+    for path in sorted(glob.glob(os.path.join(songs_dir, "*", PROFILE_FILE_NAME))):
+        with open(path, "r") as f:
+            profiles.append(json.load(f))
+
+    measures_by_stage: dict[str, list[dict]] = {}
+    for profile in profiles:
+        for stage, measure in profile["stages"].items():
+            measures_by_stage.setdefault(stage, []).append(measure)
+
+    total_wall_seconds = sum(
+        measure["wall_seconds"]
+        for measures in measures_by_stage.values()
+        for measure in measures
+    )
+
+    stages = {}
+    for stage, measures in measures_by_stage.items():
+        wall_seconds = sum(measure["wall_seconds"] for measure in measures)
+        real_time_factors = [
+            measure["real_time_factor"]
+            for measure in measures
+            if measure["real_time_factor"] is not None
+        ]
+        stages[stage] = {
+            "songs": len(measures),
+            "wall_seconds": wall_seconds,
+            "wall_share": (
+                wall_seconds / total_wall_seconds if total_wall_seconds else 0.0
+            ),
+            "mean_real_time_factor": (
+                sum(real_time_factors) / len(real_time_factors)
+                if real_time_factors
+                else None
+            ),
+            "max_real_time_factor": max(real_time_factors, default=None),
+            "cpu_utilization": (
+                sum(measure["cpu_seconds"] for measure in measures) / wall_seconds
+                if wall_seconds
+                else 0.0
+            ),
+            "max_peak_rss_bytes": max(
+                measure["peak_rss_bytes"] for measure in measures
+            ),
+        }
+
+    return {
+        "songs": len(profiles),
+        "audio_seconds": sum(profile["audio_seconds"] or 0.0 for profile in profiles),
+        "stages": stages,
+    }
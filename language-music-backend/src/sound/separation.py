@@ -1,25 +1,41 @@
+import math
 import os.path
+import shutil
+from contextlib import closing
+from functools import partial
+from typing import Callable, Iterator
 
 import pydub
-import pydub.silence
 import torch
 import torchaudio
-from torchaudio.pipelines import HDEMUCS_HIGH_MUSDB_PLUS
 from torchaudio.transforms import Fade
 
 from structlog import get_logger
 
+from src.sound.fetch import decode, stream_decoded
+from src.sound.models import SEPARATION_SAMPLE_RATE, get_separation_model
+from src.sound.silence import detect_nonsilent
+from src.sound.vad import refine_chunks
 from src.sound.utils import (
+    ORIGINAL_FILE_NAME,
     CONVERTED_FILE_NAME,
     VOCALS_FILE_NAME,
     SPLITS_DIR_NAME,
     SPLITS_TIMESTAMPS_FILE_NAME,
     SPLITS_PADDING,
+    FloatWavWriter,
+    plan_separation_chunks,
+    convert_to_numpy,
 )
 
 
 logger = get_logger()
 
+SEPARATION_SEGMENT_SECONDS = 10
+SEPARATION_OVERLAP = 0.1
+SEPARATION_BATCH_SIZE = 4
+STREAMING_READ_SECONDS = 60
+
 
 def __separate_sources(
     model,
@@ -28,6 +44,7 @@ def __separate_sources(
     overlap=0.1,
     device=None,
     sample_rate=44100,
+    batch_size=1,
 ):
     """
     Apply model to a given mixture. Use fade, and add segments together in order to add model segment by segment.
@@ -40,6 +57,8 @@ def __separate_sources(
             execute the computation, otherwise `mix.device` is assumed.
             When `device` is different from `mix.device`, only local computations will
             be on `device`, while the entire tracks will be stored on `mix.device`.
+        batch_size (int): number of chunks stacked in a single forward pass. Only chunks of the same length are
+            stacked, the model normalizes each of them separately so the output does not depend on the batch size.
     """
     if device is None:
         device = mix.device
@@ -48,53 +67,226 @@ def __separate_sources(
 
     batch, channels, length = mix.shape
 
-    chunk_len = int(sample_rate * segment * (1 + overlap))
-    start = 0
-    end = chunk_len
-    overlap_frames = overlap * sample_rate
-    fade = Fade(fade_in_len=0, fade_out_len=int(overlap_frames), fade_shape="linear")
-
     final = torch.zeros(batch, len(model.sources), channels, length, device=device)
 
-    while start < length - overlap_frames:
-        chunk = mix[:, :, start:end]
-        with torch.no_grad():
-            out = model.forward(chunk)
-        out = fade(out)
-        final[:, :, :, start:end] += out
-        if start == 0:
-            fade.fade_in_len = int(overlap_frames)
-            start += int(chunk_len - overlap_frames)
+    chunk_batches = []
+    for chunk in plan_separation_chunks(length, segment, overlap, sample_rate):
+        start, end, _, _ = chunk
+        if (
+            chunk_batches
+            and len(chunk_batches[-1]) < batch_size
+            and chunk_batches[-1][0][1] - chunk_batches[-1][0][0] == end - start
+        ):
+            chunk_batches[-1].append(chunk)
         else:
-            start += chunk_len
-        end += chunk_len
-        if end >= length:
-            fade.fade_out_len = 0
+            chunk_batches.append([chunk])
+
+    for chunk_batch in chunk_batches:
+        chunks = torch.cat([mix[:, :, start:end] for start, end, _, _ in chunk_batch])
+        with torch.no_grad():
+            out = model.forward(chunks)
+
+        for i, (start, end, fade_in_len, fade_out_len) in enumerate(chunk_batch):
+            fade = Fade(
+                fade_in_len=fade_in_len, fade_out_len=fade_out_len, fade_shape="linear"
+            )
+            final[:, :, :, start:end] += fade(out[i * batch : (i + 1) * batch])
     return final
 
 
-def extract_voice(target_location: str) -> str:
+def __read_blocks_from_file(song_file: str) -> Iterator[torch.Tensor]:
+    read_frames = STREAMING_READ_SECONDS * torchaudio.info(song_file).sample_rate
+    offset = 0
+    while True:
+        block, _ = torchaudio.load(
+            song_file, frame_offset=offset, num_frames=read_frames
+        )
+        if block.shape[1] == 0:
+            return
+        yield block
+        offset += block.shape[1]
+
+
+def __read_blocks_from_ffmpeg(
+    song_file: str, sample_rate: int, channels: int
+) -> Iterator[torch.Tensor]:
+    for block in stream_decoded(
+        song_file,
+        STREAMING_READ_SECONDS * sample_rate,
+        sample_rate=sample_rate,
+        channels=channels,
+    ):
+        yield torch.from_numpy(block.T.copy())
+
+
+def __extract_voice_streaming(
+    model,
+    read_blocks: Callable[[], Iterator[torch.Tensor]],
+    sample_rate: int,
+    channels: int,
+    output_file_name: str,
+    segment: float,
+    overlap: float,
+):
+    """
+    Same as `extract_voice`, reading the song one block at a time and writing the vocals as soon as they are final, so
+    that the memory used does not depend on the length of the song.
+
+    :param read_blocks: returns the blocks of the song in order, shaped (channels, frames). Called twice, the song is
+        read once for its statistics and once to separate it.
+    """
+    # First pass: the length, mean and standard deviation of the mono mix, to normalize the chunks like the whole song
+    length = 0
+    total = 0.0
+    total_squares = 0.0
+    for block in read_blocks():
+        ref = block.mean(0).double()
+        length += block.shape[1]
+        total += ref.sum().item()
+        total_squares += ref.square().sum().item()
+    mean = total / length
+    std = math.sqrt((total_squares - total * total / length) / (length - 1))
+
+    vocals_index = model.sources.index("vocals")
+    chunks = plan_separation_chunks(length, segment, overlap, sample_rate)
+
+    # Closed even when the separation fails, so that ffmpeg is not left running
+    with closing(read_blocks()) as blocks:
+        # The mix read so far that the next chunks still need
+        mix = torch.zeros(channels, 0)
+        mix_start = 0
+        # The vocals of the chunks separated so far that can still be overlapped by the next chunk
+        pending = torch.zeros(channels, 0)
+        pending_start = 0
+        with FloatWavWriter(output_file_name, sample_rate, channels) as writer:
+            for i, (start, end, fade_in_len, fade_out_len) in enumerate(chunks):
+                while mix_start + mix.shape[1] < end:
+                    mix = torch.cat([mix, next(blocks)], dim=1)
+                chunk = mix[:, start - mix_start : end - mix_start]
+
+                with torch.no_grad():
+                    out = model.forward(((chunk - mean) / std)[None])[0, vocals_index]
+                fade = Fade(
+                    fade_in_len=fade_in_len,
+                    fade_out_len=fade_out_len,
+                    fade_shape="linear",
+                )
+
+                buffer = torch.zeros(channels, end - pending_start)
+                buffer[:, : pending.shape[1]] = pending
+                buffer[:, start - pending_start :] += fade(out)
+
+                # Everything before the start of the next chunk is final
+                final_end = chunks[i + 1][0] if i + 1 < len(chunks) else end
+                writer.write(
+                    (buffer[:, : final_end - pending_start] * std + mean).T.numpy()
+                )
+                pending = buffer[:, final_end - pending_start :]
+                pending_start = final_end
+                mix = mix[:, final_end - mix_start :]
+                mix_start = final_end
+
+            if pending_start < length:
+                # Not covered by any chunk, silent like in `__separate_sources`
+                writer.write(
+                    torch.full((length - pending_start, channels), mean).numpy()
+                )
+
+
+def extract_voice(
+    target_location: str,
+    model=None,
+    batch_size: int = SEPARATION_BATCH_SIZE,
+    streaming: bool = False,
+    pipe_decoding: bool = False,
+) -> str:
+    """
+    :param target_location: the directory of the song
+    :param model: the separation model, defaults to the one shared by the process
+    :param batch_size: the number of chunks separated in a single forward pass
+    :param streaming: separate the song chunk by chunk, keeping only the vocals, for songs too long to fit in memory
+    :param pipe_decoding: decode the downloaded song with ffmpeg straight into memory, at the sample rate of the model,
+        instead of reading the converted file
+    """
     logger.info("Extracting vocals")
-    bundle = HDEMUCS_HIGH_MUSDB_PLUS
-    model = bundle.get_model()
-    device = torch.device("cpu")
-    model.to(device)
 
-    # We download the audio file from our storage. Feel free to download another file and use audio from a specific path
-    song_file = os.path.join(target_location, CONVERTED_FILE_NAME)
-    waveform, sample_rate = torchaudio.load(
-        song_file
-    )  # replace SAMPLE_SONG with desired path for different song
+    output_file_name = os.path.join(target_location, VOCALS_FILE_NAME)
+    if pipe_decoding:
+        song_file = os.path.join(target_location, ORIGINAL_FILE_NAME)
+    else:
+        # We download the audio file from our storage. Feel free to download another file and use audio from a specific path
+        song_file = os.path.join(target_location, CONVERTED_FILE_NAME)
+
+    if streaming:
+        if pipe_decoding:
+            read_blocks = partial(
+                __read_blocks_from_ffmpeg, song_file, SEPARATION_SAMPLE_RATE, 2
+            )
+            sample_rate, channels = SEPARATION_SAMPLE_RATE, 2
+        else:
+            info = torchaudio.info(song_file)
+            read_blocks = partial(__read_blocks_from_file, song_file)
+            sample_rate, channels = info.sample_rate, info.num_channels
+
+        if sample_rate == SEPARATION_SAMPLE_RATE:
+            if model is None:
+                model = get_separation_model()
+            __extract_voice_streaming(
+                model,
+                read_blocks,
+                sample_rate,
+                channels,
+                output_file_name,
+                segment=SEPARATION_SEGMENT_SECONDS,
+                overlap=SEPARATION_OVERLAP,
+            )
+            return output_file_name
+
+        logger.warn("Streaming separation needs 44100Hz audio, loading the song")
+
+    if pipe_decoding:
+        waveform = torch.from_numpy(
+            decode(song_file, sample_rate=SEPARATION_SAMPLE_RATE).T.copy()
+        )
+        sample_rate = SEPARATION_SAMPLE_RATE
+    else:
+        waveform, sample_rate = torchaudio.load(
+            song_file
+        )  # replace SAMPLE_SONG with desired path for different song
+
+    vocals, sample_rate = separate_vocals(
+        waveform, sample_rate, model=model, batch_size=batch_size
+    )
+    # Like the streaming separation, an interrupted save should never leave a truncated file behind
+    torchaudio.save(output_file_name + ".tmp", vocals, sample_rate, format="wav")
+    os.replace(output_file_name + ".tmp", output_file_name)
+
+    return output_file_name
+
+
+def separate_vocals(
+    waveform: torch.Tensor,
+    sample_rate: int,
+    model=None,
+    batch_size: int = SEPARATION_BATCH_SIZE,
+) -> tuple[torch.Tensor, int]:
+    """
+    Separate the vocals of a song held in memory, see `extract_voice`
+
+    :param waveform: the song, shaped (channels, frames)
+    :return: the vocals, shaped (channels, frames), and their sample rate
+    """
+    if model is None:
+        model = get_separation_model()
+    device = torch.device("cpu")
     waveform = waveform.to(device)
 
-    if sample_rate != 44100:
+    if sample_rate != SEPARATION_SAMPLE_RATE:
         logger.warn("Warn: Resampling to 44100Hz", sample_rate=sample_rate)
-        waveform = torchaudio.functional.resample(waveform, sample_rate, 44100)
-        sample_rate = 44100
-
-    # parameters
-    segment: int = 10
-    overlap = 0.1
+        waveform = torchaudio.functional.resample(
+            waveform, sample_rate, SEPARATION_SAMPLE_RATE
+        )
+        sample_rate = SEPARATION_SAMPLE_RATE
 
     ref = waveform.mean(0)
     waveform = (waveform - ref.mean()) / ref.std()  # normalization
@@ -103,8 +295,9 @@ def extract_voice(target_location: str) -> str:
         model,
         waveform[None],
         device=device,
-        segment=segment,
-        overlap=overlap,
+        segment=SEPARATION_SEGMENT_SECONDS,
+        overlap=SEPARATION_OVERLAP,
+        batch_size=batch_size,
     )[0]
     sources = sources * ref.std() + ref.mean()
 
@@ -113,18 +306,49 @@ def extract_voice(target_location: str) -> str:
 
     audios = dict(zip(sources_list, sources))
 
-    output_file_name = os.path.join(target_location, VOCALS_FILE_NAME)
-    torchaudio.save(output_file_name, audios["vocals"], sample_rate)
-
-    return output_file_name
+    return audios["vocals"], sample_rate
 
 
-def split(target_location: str) -> str:
+def split(
+    target_location: str,
+    min_silence_len: int = 5000,
+    silence_thresh: float = -32,
+    vocal_activity: bool = False,
+) -> str:
+    """
+    :param target_location: the directory of the song
+    :param min_silence_len: the shortest silence, in milliseconds, the vocals are split on
+    :param silence_thresh: the loudness, in dBFS, under which the vocals are silent
+    :param vocal_activity: cut the splits down to the parts where someone sings, see `refine_chunks`
+    """
     logger.info("Splitting vocals")
     vocals_file = os.path.join(target_location, VOCALS_FILE_NAME)
     sound = pydub.AudioSegment.from_file(vocals_file, format="wav")
-    chunk_timestamps = pydub.silence.detect_nonsilent(
-        sound, min_silence_len=5000, silence_thresh=-32
+
+    chunks, chunk_timestamps = split_vocals(
+        sound, min_silence_len=min_silence_len, silence_thresh=silence_thresh
+    )
+    if vocal_activity:
+        chunks, chunk_timestamps = refine_chunks(chunks, chunk_timestamps)
+
+    return write_splits(target_location, chunks, chunk_timestamps)
+
+
+def split_vocals(
+    sound: pydub.AudioSegment, min_silence_len: int = 5000, silence_thresh: float = -32
+) -> tuple[list[pydub.AudioSegment], list[tuple[int, int]]]:
+    """
+    Split the vocals on the long silences, see `split`
+
+    :return: the chunks, and the start and end of each chunk in milliseconds
+    """
+    samples, frame_rate = convert_to_numpy(sound)
+    chunk_timestamps = detect_nonsilent(
+        samples,
+        frame_rate,
+        min_silence_len=min_silence_len,
+        silence_thresh=silence_thresh,
+        sample_width=sound.sample_width,
     )
 
     chunk_timestamps = [
@@ -139,9 +363,19 @@ def split(target_location: str) -> str:
         for i in range(len(chunk_timestamps))
     ]
 
+    return chunks, chunk_timestamps
+
+
+def write_splits(
+    target_location: str,
+    chunks: list[pydub.AudioSegment],
+    chunk_timestamps: list[tuple[int, int]],
+) -> str:
     splits_dir = os.path.join(target_location, SPLITS_DIR_NAME)
-    if not os.path.exists(splits_dir):
-        os.makedirs(splits_dir)
+    # Don't leave the splits of a previous run behind, the splits may be fewer this time
+    if os.path.exists(splits_dir):
+        shutil.rmtree(splits_dir)
+    os.makedirs(splits_dir)
 
     logger.info("Splitting vocals", chunks_count=len(chunks))
     for i in range(len(chunks)):
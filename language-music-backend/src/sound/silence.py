@@ -0,0 +1,153 @@
+import time
+
+import numpy as np
+import pydub
+import pydub.silence
+
+from src.sound.utils import convert_to_numpy
+
+
+def detect_silence(
+    samples: np.ndarray,
+    frame_rate: int,
+    min_silence_len: int = 1000,
+    silence_thresh: float = -16,
+    seek_step: int = 1,
+    sample_width: int = 2,
+) -> list[list[int]]:
+    """
+    Same as `pydub.silence.detect_silence`, on an array of samples.
+
+    pydub measures the RMS of every window of `min_silence_len` milliseconds in a python loop. Here the RMS of all the
+    windows comes from differences of a cumulative sum of the squared samples.
+
+    :param samples: float samples between -1 and 1, shaped (frames, channels), see `convert_to_numpy`
+    :param frame_rate: the sample rate of the samples
+    :param sample_width: the bytes per sample of the audio the samples were converted from. pydub truncates the RMS to
+        an integer sample value, so the windows close to the threshold are classified the same way.
+    :return: the silent ranges, [start, end] in milliseconds
+    """
+    frames, channels = samples.shape
+    seg_len = round(1000 * (frames / frame_rate))
+
+    # you can't have a silent portion of a sound that is longer than the sound
+    if seg_len < min_silence_len:
+        return []
+
+    max_possible_amplitude = 1 << (8 * sample_width - 1)
+    threshold = 10 ** (silence_thresh / 20) * max_possible_amplitude
+
+    last_slice_start = seg_len - min_silence_len
+    slice_starts = np.arange(0, last_slice_start + 1, seek_step)
+    if last_slice_start % seek_step:
+        slice_starts = np.append(slice_starts, last_slice_start)
+    slice_ends = np.minimum(slice_starts + min_silence_len, seg_len)
+
+    # The frames of a window are cut like pydub slices the segment
+    start_frames = (slice_starts * (frame_rate / 1000.0)).astype(np.int64)
+    end_frames = (slice_ends * (frame_rate / 1000.0)).astype(np.int64)
+
+    energy = np.zeros(frames + 1)
+    np.cumsum(np.square(samples, dtype=np.float64).sum(axis=1), out=energy[1:])
+    # pydub pads a window running past the last frame with silence, it still counts in the mean
+    window_energy = energy[np.minimum(end_frames, frames)] - energy[start_frames]
+    window_samples = np.maximum((end_frames - start_frames) * channels, 1)
+    rms = np.floor(
+        np.sqrt(window_energy / window_samples) * max_possible_amplitude + 1e-9
+    )
+
+    silence_starts = slice_starts[rms <= threshold]
+
+    # short circuit when there is no silence
+    if not len(silence_starts):
+        return []
+
+    # Windows overlapping each other are combined in a single range, even when a few windows between them are not
+    # silent
+    previous_starts = silence_starts[:-1]
+    next_starts = silence_starts[1:]
+    breaks = (next_starts != previous_starts + seek_step) & (
+        next_starts > previous_starts + min_silence_len
+    )
+    range_starts = np.concatenate([silence_starts[:1], next_starts[breaks]])
+    range_ends = np.concatenate([previous_starts[breaks], silence_starts[-1:]])
+
+    return [
+        [int(start), int(end) + min_silence_len]
+        for start, end in zip(range_starts, range_ends)
+    ]
+
+
+def detect_nonsilent(
+    samples: np.ndarray,
+    frame_rate: int,
+    min_silence_len: int = 1000,
+    silence_thresh: float = -16,
+    seek_step: int = 1,
+    sample_width: int = 2,
+) -> list[list[int]]:
+    """
+    Same as `pydub.silence.detect_nonsilent`, on an array of samples, see `detect_silence`
+
+    :return: the non silent ranges, [start, end] in milliseconds
+    """
+    silent_ranges = detect_silence(
+        samples, frame_rate, min_silence_len, silence_thresh, seek_step, sample_width
+    )
+    len_seg = round(1000 * (len(samples) / frame_rate))
+
+    # if there is no silence, the whole thing is nonsilent
+    if not silent_ranges:
+        return [[0, len_seg]]
+
+    # short circuit when the whole audio segment is silent
+    if silent_ranges[0][0] == 0 and silent_ranges[0][1] == len_seg:
+        return []
+
+    prev_end_i = 0
+    nonsilent_ranges = []
+    for start_i, end_i in silent_ranges:
+        nonsilent_ranges.append([prev_end_i, start_i])
+        prev_end_i = end_i
+
+    if silent_ranges[-1][1] != len_seg:
+        nonsilent_ranges.append([prev_end_i, len_seg])
+
+    if nonsilent_ranges[0] == [0, 0]:
+        nonsilent_ranges.pop(0)
+
+    return nonsilent_ranges
+
+
+def benchmark_silence_detection(
+    sound: pydub.AudioSegment, min_silence_len: int = 5000, silence_thresh: float = -32
+) -> dict:
+    """
+    Run `detect_nonsilent` and the pydub implementation on the same sound
+
+    :return: the seconds taken by each implementation, and whether they found the same ranges
+    """
+    start = time.perf_counter()
+    expected = pydub.silence.detect_nonsilent(
+        sound, min_silence_len=min_silence_len, silence_thresh=silence_thresh
+    )
+    pydub_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    samples, frame_rate = convert_to_numpy(sound)
+    actual = detect_nonsilent(
+        samples,
+        frame_rate,
+        min_silence_len=min_silence_len,
+        silence_thresh=silence_thresh,
+        sample_width=sound.sample_width,
+    )
+    numpy_seconds = time.perf_counter() - start
+
+    return {
+        "pydub_seconds": pydub_seconds,
+        "numpy_seconds": numpy_seconds,
+        "equivalent": expected == actual,
+        "pydub_ranges": expected,
+        "numpy_ranges": actual,
+    }
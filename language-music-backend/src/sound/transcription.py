@@ -1,24 +1,128 @@
+import atexit
 import json
+import multiprocessing
 import os.path
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Union
 
+import numpy as np
+import pydub
+import torch
+import torchaudio
 import whisper_timestamped as whisper
 from tqdm import tqdm
 
+from src.sound.models import get_transcription_model
 from src.sound.utils import (
     SPLITS_DIR_NAME,
     SPLITS_TIMESTAMPS_FILE_NAME,
     TRANSCRIPTION_FILE_NAME,
+    convert_to_numpy,
 )
 from structlog import get_logger
 
 logger = get_logger()
 
+WHISPER_SAMPLE_RATE = 16000
 
-def transcribe(target_location: str, language: str):
-    logger.info("Transcribing audio")
+# The songs of `SoundWorker` are transcribed from several threads, the pool of a worker count is created once
+__transcription_pool_lock = threading.Lock()
+
+
+def to_whisper_audio(sound: pydub.AudioSegment) -> np.ndarray:
+    """
+    Mono float samples at the sample rate of whisper, what whisper decodes an audio file to
+    """
+    samples, sample_rate = convert_to_numpy(sound)
+    mono = torch.from_numpy(samples.mean(axis=1))
+
+    return torchaudio.functional.resample(
+        mono, sample_rate, WHISPER_SAMPLE_RATE
+    ).numpy()
+
+
+def __transcribe_chunk(
+    model, audio: Union[str, np.ndarray], language: str, offset: float
+) -> dict:
+    """
+    Transcribe one split, shifting the timestamps by the position of the split in the song
+
+    :param audio: the path of the split, or its samples as returned by `to_whisper_audio`
+    :param offset: the start of the split in the song, in seconds
+    """
+    result = whisper.transcribe(
+        model,
+        audio=audio,
+        task="transcribe",
+        initial_prompt="lyrics:",
+        language=language,
+    )
+
+    return {
+        "text": result["text"],
+        "segments": [
+            {
+                **s,
+                "end": s["end"] + offset,
+                "start": s["start"] + offset,
+                "words": [
+                    {
+                        **w,
+                        "end": w["end"] + offset,
+                        "start": w["start"] + offset,
+                    }
+                    for w in s["words"]
+                ],
+            }
+            for s in result["segments"]
+        ],
+    }
+
+
+def _init_transcription_worker(threads: int):
+    torch.set_num_threads(threads)
+    get_transcription_model()
+
+
+@lru_cache()
+def get_transcription_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    The processes transcribing the splits, started once per worker count and shared by every song, so that each worker
+    loads whisper only once. Shut down when the process exits.
+    """
+    # Spawn rather than fork, torch does not survive forking once its thread pool is started. The threads of the
+    # machine are split between the workers.
+    pool = ProcessPoolExecutor(
+        workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_transcription_worker,
+        initargs=(max(os.cpu_count() // workers, 1),),
+    )
+    atexit.register(pool.shutdown)
+    logger.info("Transcription pool started", workers=workers)
+
+    return pool
+
+
+def _transcribe_chunk_in_worker(
+    audio: Union[str, np.ndarray], language: str, offset: float
+) -> dict:
+    return __transcribe_chunk(get_transcription_model(), audio, language, offset)
+
+
+def transcribe(target_location: str, language: str, model=None, workers: int = 1):
+    """
+    :param target_location: the directory of the song
+    :param language: the language of the lyrics
+    :param model: the whisper model, defaults to the one shared by the process. Ignored with several workers, each
+        worker process loads its own, see `get_transcription_pool`.
+    :param workers: the number of splits transcribed in parallel
+    """
+    logger.info("Transcribing audio", workers=workers)
     splits_dir = os.path.join(target_location, SPLITS_DIR_NAME)
-    model = whisper.load_model("openai/whisper-medium")
-    logger.debug("Model loaded")
 
     # read timestamp delays
     with open(os.path.join(splits_dir, SPLITS_TIMESTAMPS_FILE_NAME), "r") as f:
@@ -29,45 +133,58 @@ def transcribe(target_location: str, language: str):
         ]
     logger.debug("Timestamps loaded", chunk_timestamps=chunk_timestamps)
 
-    full_transcription = {"segments": [], "text": ""}
-
-    # list files in splits_dir
-    for i in tqdm(range(len(chunk_timestamps)), desc="Transcribing"):
-        file_name = f"{i}.wav"
-
-        result = whisper.transcribe(
-            model,
-            audio=os.path.join(splits_dir, file_name),
-            task="transcribe",
-            initial_prompt="lyrics:",
-            language=language,
-        )
-        timestamp_adjustment = chunk_timestamps[i][0] / 1000
-
-        result_adjusted = {
-            "text": result["text"],
-            "segments": [
-                {
-                    **s,
-                    "end": s["end"] + timestamp_adjustment,
-                    "start": s["start"] + timestamp_adjustment,
-                    "words": [
-                        {
-                            **w,
-                            "end": w["end"] + timestamp_adjustment,
-                            "start": w["start"] + timestamp_adjustment,
-                        }
-                        for w in s["words"]
-                    ],
-                }
-                for s in result["segments"]
-            ],
-        }
-
-        full_transcription = {
-            "text": full_transcription["text"] + result_adjusted["text"],
-            "segments": full_transcription["segments"] + result_adjusted["segments"],
-        }
+    chunks = [
+        (os.path.join(splits_dir, f"{i}.wav"), chunk_timestamps[i][0] / 1000)
+        for i in range(len(chunk_timestamps))
+    ]
+    full_transcription = transcribe_chunks(
+        chunks, language, model=model, workers=workers
+    )
 
     with open(os.path.join(target_location, TRANSCRIPTION_FILE_NAME), "w") as f:
         json.dump(full_transcription, f)
+
+
+def transcribe_chunks(
+    chunks: list[tuple[Union[str, np.ndarray], float]],
+    language: str,
+    model=None,
+    workers: int = 1,
+) -> dict:
+    """
+    Transcribe the splits of a song into a single transcription, see `transcribe`
+
+    :param chunks: the audio of each split, a path or samples, and its start in the song in seconds
+    :return: the transcription, with the timestamps of the song
+    """
+    chunks = [(audio, language, offset) for audio, offset in chunks]
+
+    if workers > 1:
+        with __transcription_pool_lock:
+            pool = get_transcription_pool(workers)
+        try:
+            futures = [
+                pool.submit(_transcribe_chunk_in_worker, *chunk) for chunk in chunks
+            ]
+            # Collected in the order of the chunks, whichever finishes first
+            results = [future.result() for future in tqdm(futures, desc="Transcribing")]
+        except BrokenProcessPool:
+            # A worker died, the next song starts a new pool
+            with __transcription_pool_lock:
+                get_transcription_pool.cache_clear()
+            pool.shutdown(wait=False)
+            raise
+    else:
+        if model is None:
+            model = get_transcription_model()
+        results = [
+            __transcribe_chunk(model, *chunk)
+            for chunk in tqdm(chunks, desc="Transcribing")
+        ]
+
+    full_transcription = {"segments": [], "text": ""}
+    for result in results:
+        full_transcription["segments"].extend(result["segments"])
+    full_transcription["text"] = "".join(result["text"] for result in results)
+
+    return full_transcription
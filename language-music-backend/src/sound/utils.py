@@ -1,3 +1,6 @@
+import os
+import struct
+
 import pydub
 import numpy as np
 
@@ -7,10 +10,43 @@ VOCALS_FILE_NAME = "vocals.wav"
 SPLITS_DIR_NAME = "splits"
 SPLITS_TIMESTAMPS_FILE_NAME = "timestamps.txt"
 TRANSCRIPTION_FILE_NAME = "transcription.json"
+LRC_FILE_NAME = "lyrics.lrc"
 
 SPLITS_PADDING = 2000  # ms
 
 
+def plan_separation_chunks(
+    length: int, segment: float, overlap: float, sample_rate: int
+) -> list[tuple[int, int, int, int]]:
+    """
+    The chunks the mixture is separated in: start, end, fade in length and fade out length of each chunk.
+
+    Consecutive chunks overlap by `overlap` seconds, where the first one fades out while the second one fades in. The
+    linear fades of an overlap add up to 1, and the last chunk does not fade out, so every frame of the song keeps its
+    full weight.
+    """
+    chunk_len = int(sample_rate * segment * (1 + overlap))
+    start = 0
+    end = chunk_len
+    overlap_frames = overlap * sample_rate
+    fade_in_len = 0
+    # A song shorter than one chunk is a single chunk, nothing overlaps its end
+    fade_out_len = int(overlap_frames) if end < length else 0
+
+    chunks = []
+    while start < length - overlap_frames:
+        chunks.append((start, min(end, length), fade_in_len, fade_out_len))
+        if start == 0:
+            fade_in_len = int(overlap_frames)
+            start += int(chunk_len - overlap_frames)
+        else:
+            start += chunk_len
+        end += chunk_len
+        if end >= length:
+            fade_out_len = 0
+    return chunks
+
+
 def convert_to_numpy(audio: pydub.AudioSegment):
     return (
         np.array(audio.get_array_of_samples(), dtype=np.float32).reshape(
@@ -19,3 +55,85 @@ def convert_to_numpy(audio: pydub.AudioSegment):
         / (1 << (8 * audio.sample_width - 1)),
         audio.frame_rate,
     )
+
+
+def convert_from_numpy(samples: np.ndarray, sample_rate: int) -> pydub.AudioSegment:
+    """
+    The reverse of `convert_to_numpy`, as 16-bit audio
+
+    :param samples: float samples between -1 and 1, shaped (frames, channels)
+    """
+    pcm = (np.clip(samples, -1, 1) * ((1 << 15) - 1)).astype("<i2")
+    return pydub.AudioSegment(
+        data=pcm.tobytes(),
+        sample_width=2,
+        frame_rate=sample_rate,
+        channels=samples.shape[1],
+    )
+
+
+class FloatWavWriter:
+    """
+    Writes a 32-bit float WAV file a few frames at a time. The sizes in the header are filled in on close.
+
+    The frames go to a temporary file, moved to `path` only on close. Used as a context manager, an exception discards
+    the temporary file, so a crash never leaves a truncated file that looks complete.
+    """
+
+    _HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+    _WAVE_FORMAT_IEEE_FLOAT = 3
+
+    def __init__(self, path: str, sample_rate: int, channels: int):
+        self.path = path
+        self.file = open(path + ".tmp", "wb")
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.data_size = 0
+        self._write_header()
+
+    def _write_header(self):
+        block_align = 4 * self.channels
+        self.file.write(
+            self._HEADER.pack(
+                b"RIFF",
+                self._HEADER.size - 8 + self.data_size,
+                b"WAVE",
+                b"fmt ",
+                16,
+                self._WAVE_FORMAT_IEEE_FLOAT,
+                self.channels,
+                self.sample_rate,
+                self.sample_rate * block_align,
+                block_align,
+                32,
+                b"data",
+                self.data_size,
+            )
+        )
+
+    def write(self, frames: np.ndarray):
+        """
+        :param frames: the samples, shaped (frames, channels)
+        """
+        data = np.ascontiguousarray(frames, dtype="<f4").tobytes()
+        self.file.write(data)
+        self.data_size += len(data)
+
+    def close(self):
+        self.file.seek(0)
+        self._write_header()
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path + ".tmp")
+
+    def __enter__(self) -> "FloatWavWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
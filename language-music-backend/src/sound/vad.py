@@ -0,0 +1,116 @@
+import numpy as np
+import pydub
+
+from src.sound.utils import convert_to_numpy
+
+VAD_FRAME_MS = 20
+VAD_FREQUENCY_BAND = (100, 4000)  # Hz, where the energy of the voice is
+
+
+def frame_features(
+    samples: np.ndarray, frame_rate: int, frame_ms: int = VAD_FRAME_MS
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The loudness and the spectral flatness of consecutive frames of the audio
+
+    :param samples: float samples between -1 and 1, shaped (frames, channels), see `convert_to_numpy`
+    :return: the loudness of each frame in dBFS, and the spectral flatness of each frame in the voice band, between 0
+        for a pure tone and about 0.56 for white noise
+    """
+    frame_len = int(frame_rate * frame_ms / 1000)
+    frame_count = len(samples) // frame_len
+    mono = samples[: frame_count * frame_len].mean(axis=1, dtype=np.float64)
+    frames = mono.reshape((frame_count, frame_len))
+
+    rms = np.sqrt(np.mean(np.square(frames), axis=1))
+    loudness = 20 * np.log10(np.maximum(rms, 1e-10))
+
+    power = np.square(np.abs(np.fft.rfft(frames * np.hanning(frame_len), axis=1)))
+    frequencies = np.fft.rfftfreq(frame_len, 1 / frame_rate)
+    low, high = VAD_FREQUENCY_BAND
+    band = power[:, (frequencies >= low) & (frequencies <= high)] + 1e-20
+    flatness = np.exp(np.mean(np.log(band), axis=1)) / np.mean(band, axis=1)
+
+    return loudness, flatness
+
+
+def detect_vocal_activity(
+    samples: np.ndarray,
+    frame_rate: int,
+    energy_thresh: float = -45,
+    noise_margin: float = 10,
+    max_threshold: float = -30,
+    max_flatness: float = 0.4,
+    min_activity_len: int = 200,
+    min_gap_len: int = 1000,
+    padding: int = 300,
+) -> list[list[int]]:
+    """
+    The parts of separated vocals where someone sings.
+
+    A frame is voiced when it is louder than both `energy_thresh` and the noise floor of the audio plus `noise_margin`,
+    capped at `max_threshold`, and its spectrum is peaky enough to be harmonic: the instruments bleeding through the
+    separation are mostly percussive and noise-like, so they are louder than the floor but flat. The voiced frames are
+    then merged across the short gaps between words, and the short bursts are dropped.
+
+    :param samples: float samples between -1 and 1, shaped (frames, channels), see `convert_to_numpy`
+    :param energy_thresh: the loudness, in dBFS, under which a frame is never voiced
+    :param noise_margin: how many dB above the noise floor, the loudness of the 10% quietest frames, a frame is voiced
+    :param max_threshold: the loudness, in dBFS, above which a frame is loud enough whatever the noise floor. In a split
+        sung from start to end, the 10% quietest frames are still singing, the floor would be on the voice itself.
+    :param max_flatness: the spectral flatness above which a frame is noise rather than voice
+    :param min_activity_len: the shortest voiced part kept, in milliseconds
+    :param min_gap_len: the shortest unvoiced gap, in milliseconds, the voiced parts are not merged across
+    :param padding: the milliseconds kept before and after each voiced part
+    :return: the voiced ranges, [start, end] in milliseconds
+    """
+    length = round(1000 * len(samples) / frame_rate)
+    loudness, flatness = frame_features(samples, frame_rate)
+    if not len(loudness):
+        return []
+
+    noise_floor = np.percentile(loudness, 10)
+    threshold = max(energy_thresh, min(noise_floor + noise_margin, max_threshold))
+    voiced = (loudness > threshold) & (flatness < max_flatness)
+
+    # The runs of voiced frames, as [start, end) frame indexes
+    edges = np.diff(voiced.astype(np.int8), prepend=0, append=0)
+    runs = np.stack([np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)], axis=1)
+
+    ranges = []
+    for start, end in runs * VAD_FRAME_MS:
+        if ranges and start - ranges[-1][1] < min_gap_len:
+            ranges[-1][1] = int(end)
+        else:
+            ranges.append([int(start), int(end)])
+
+    return [
+        [max(start - padding, 0), min(end + padding, length)]
+        for start, end in ranges
+        if end - start >= min_activity_len
+    ]
+
+
+def refine_chunks(
+    chunks: list[pydub.AudioSegment],
+    chunk_timestamps: list[tuple[int, int]],
+    **vad_options,
+) -> tuple[list[pydub.AudioSegment], list[tuple[int, int]]]:
+    """
+    Cut the splits of `split_vocals` down to their voiced parts, see `detect_vocal_activity`
+
+    A split can give several sub-chunks, or none when nobody sings in it. The timestamps of the sub-chunks are in the
+    time of the song like those of the splits, so the transcription places them the same way.
+
+    :param vad_options: passed to `detect_vocal_activity`
+    :return: the sub-chunks, and the start and end of each sub-chunk in the song in milliseconds
+    """
+    sub_chunks = []
+    sub_chunk_timestamps = []
+    for chunk, (chunk_start, _) in zip(chunks, chunk_timestamps):
+        samples, frame_rate = convert_to_numpy(chunk)
+        for start, end in detect_vocal_activity(samples, frame_rate, **vad_options):
+            sub_chunks.append(chunk[start:end])
+            sub_chunk_timestamps.append((chunk_start + start, chunk_start + end))
+
+    return sub_chunks, sub_chunk_timestamps
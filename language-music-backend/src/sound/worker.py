@@ -0,0 +1,200 @@
+import json
+import os.path
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
+
+from structlog import get_logger
+
+from src.sound.process import plan_stages
+
+logger = get_logger()
+
+# Downloads wait on the network and conversions on ffmpeg, while separation and transcription use all the cores
+DEFAULT_STAGE_CONCURRENCY = {
+    "download": 2,
+    "convert": 2,
+    "extract_voice": 1,
+    "split": 2,
+    "transcribe": 1,
+    "in_memory": 1,
+}
+
+
+def read_job_queue(
+    queue_path: str, follow: bool = False, poll_seconds: float = 5.0
+) -> Iterator[tuple[str, str]]:
+    """
+    Read the jobs of a JSONL file, one {"youtube_id": ..., "language": ...} object per line
+
+    :param follow: keep waiting for new lines appended to the file, like `tail -f`
+    :return: the youtube id and the language of each job
+    """
+    with open(queue_path, "r") as f:
+        pending = ""
+        while True:
+            pending += f.readline()
+            if pending.endswith("\n") or (pending and not follow):
+                if pending.strip():
+                    job = json.loads(pending)
+                    yield job["youtube_id"], job["language"]
+                pending = ""
+            elif not follow:
+                return
+            else:
+                # Nothing more yet, or a line still being written
+                time.sleep(poll_seconds)
+
+
+def _failed(youtube_id: str, stage: str, seconds: float, error: Exception) -> dict:
+    return {
+        "youtube_id": youtube_id,
+        "status": "failed",
+        "stage": stage,
+        "seconds": seconds,
+        "error": repr(error),
+    }
+
+
+class SoundWorker:
+    """
+    Runs the stages of `process` for many songs at once, each stage in its own thread pool.
+
+    A song goes through its stages in order, but the stages of different songs overlap: the next song downloads while
+    the current one is separated and the previous one is transcribed. The size of the pool of each stage bounds how
+    many songs are in that stage at the same time.
+    """
+
+    def __init__(
+        self,
+        stage_concurrency: Optional[dict[str, int]] = None,
+        max_songs_in_flight: int = 4,
+        **process_options,
+    ):
+        """
+        :param stage_concurrency: the number of songs each stage handles at once, by stage name. Defaults to
+            `DEFAULT_STAGE_CONCURRENCY`.
+        :param max_songs_in_flight: how many songs can be started and not finished. Submitting more blocks.
+        :param process_options: passed to `plan_stages`, like `transcription_workers` or `in_memory`
+        """
+        concurrency = {**DEFAULT_STAGE_CONCURRENCY, **(stage_concurrency or {})}
+        self.pools = {
+            stage: ThreadPoolExecutor(workers, thread_name_prefix=stage)
+            for stage, workers in concurrency.items()
+        }
+        self.songs_in_flight = threading.Semaphore(max_songs_in_flight)
+        self.process_options = process_options
+
+    def submit(self, youtube_id: str, language: str) -> Future:
+        """
+        :return: a future resolved with the result of the song once its last stage is done
+        """
+        self.songs_in_flight.acquire()
+        song = Future()
+        song.add_done_callback(lambda _: self.songs_in_flight.release())
+
+        try:
+            stages = plan_stages(youtube_id, language, **self.process_options)
+        except Exception as e:
+            song.set_result(_failed(youtube_id, "plan", 0.0, e))
+            return song
+
+        self._submit_stage(song, youtube_id, stages, 0, time.perf_counter())
+
+        return song
+
+    def _submit_stage(
+        self,
+        song: Future,
+        youtube_id: str,
+        stages: list[tuple[str, Callable[[], None]]],
+        index: int,
+        start: float,
+    ):
+        name, run_stage = stages[index]
+
+        def on_done(stage: Future):
+            error = stage.exception()
+            if error is not None:
+                logger.error(
+                    "Stage failed", youtube_id=youtube_id, stage=name, error=repr(error)
+                )
+                song.set_result(
+                    _failed(youtube_id, name, time.perf_counter() - start, error)
+                )
+            elif index + 1 < len(stages):
+                self._submit_stage(song, youtube_id, stages, index + 1, start)
+            else:
+                song.set_result(
+                    {
+                        "youtube_id": youtube_id,
+                        "status": "ok",
+                        "stage": None,
+                        "seconds": time.perf_counter() - start,
+                        "error": None,
+                    }
+                )
+
+        self.pools[name].submit(run_stage).add_done_callback(on_done)
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+
+
+def run_sound_worker(
+    queue_path: str,
+    follow: bool = False,
+    stage_concurrency: Optional[dict[str, int]] = None,
+    max_songs_in_flight: int = 4,
+    **process_options,
+) -> list[dict]:
+    """
+    Process the jobs of a queue file with a `SoundWorker`. The result of each song is appended to a results file next
+    to the queue, and the songs already processed successfully are skipped when the worker restarts.
+
+    :return: the results of the songs processed by this run
+    """
+    results_path = os.path.splitext(queue_path)[0] + ".results.jsonl"
+    completed = set()
+    if os.path.exists(results_path):
+        with open(results_path, "r") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if result["status"] == "ok":
+                    completed.add(result["youtube_id"])
+
+    worker = SoundWorker(stage_concurrency, max_songs_in_flight, **process_options)
+    results = []
+    lock = threading.Lock()
+
+    with open(results_path, "a") as results_file:
+
+        def record(song: Future):
+            result = song.result()
+            with lock:
+                results.append(result)
+                results_file.write(json.dumps(result) + "\n")
+                results_file.flush()
+            logger.info("Finished processing song", **result)
+
+        songs = []
+        try:
+            for youtube_id, language in read_job_queue(queue_path, follow=follow):
+                if youtube_id in completed:
+                    continue
+                completed.add(youtube_id)
+
+                song = worker.submit(youtube_id, language)
+                song.add_done_callback(record)
+                songs.append(song)
+        finally:
+            for song in songs:
+                song.exception()
+            worker.shutdown()
+
+    return results
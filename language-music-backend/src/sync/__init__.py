@@ -1,2 +1,3 @@
 from .sync import *
 from .lrc import *
+from .tokens import *
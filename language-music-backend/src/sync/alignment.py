@@ -0,0 +1,150 @@
+import math
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from src.sync.scoring import score_windows
+from src.sync.tokens import TokenizedLyrics
+
+# How the cell of the alignment matrix was reached, used to walk back the best path
+_SKIP_WORD = 0
+_SKIP_SEGMENT = 1
+_MATCH = 2
+
+
+def _span_lengths(segment_size: int) -> range:
+    """
+    The number of lyrics words a segment is allowed to cover.
+
+    Whisper merges words ("sångomandra" for "som dem andra") and splits others, so we allow spans between half and
+    double the number of words in the segment.
+    """
+    return range(max(math.ceil(segment_size / 2), 1), 2 * segment_size + 1)
+
+
+def _band(
+    row: int, cumulative_sizes: List[int], total_words: int, band_width: int
+) -> Tuple[int, int]:
+    """
+    The range of lyrics positions the alignment may reach after `row` segments.
+
+    The band follows the diagonal we would expect if the words of the segments were spread evenly over the lyrics.
+    """
+    expected = round(total_words * cumulative_sizes[row] / max(cumulative_sizes[-1], 1))
+
+    return max(expected - band_width, 0), min(expected + band_width, total_words) + 1
+
+
+def align_passages_dp(
+    relevant_segments: List[Dict],
+    lyrics: TokenizedLyrics,
+    band_width: int = 60,
+    matching_threshold: float = 0.5,
+    word_skip_penalty: float = 0.25,
+) -> List[Tuple[int, int]]:
+    """
+    Align the segments to the lyrics in a single dynamic programming pass.
+
+    The alignment is monotonic: each segment covers a span of lyrics words that starts where the previous one ended or
+    later. A segment can also be skipped (it gets an empty passage), which is what we want for hallucinations. Matching
+    a segment gains `(ratio - matching_threshold) * segment words`, skipping a lyrics word costs `word_skip_penalty`.
+
+    Only the cells within `band_width` words of the expected diagonal are computed, so the cost grows linearly with
+    the length of the song instead of quadratically.
+
+    :param relevant_segments: the whisper segments
+    :param lyrics:
+    :param band_width: how far (in words) the alignment may drift from the expected diagonal
+    :param matching_threshold: the fuzzy ratio (0 to 1) under which a match is worse than skipping the segment
+    :param word_skip_penalty: the cost of leaving a lyrics word outside all the passages
+    :return: a (start, end) passage for each segment, empty passages for skipped segments
+    """
+    segment_texts = [segment["text"].strip() for segment in relevant_segments]
+    segment_sizes = [len(text.split()) for text in segment_texts]
+    total_words = len(lyrics)
+
+    cumulative_sizes = [0]
+    for size in segment_sizes:
+        cumulative_sizes.append(cumulative_sizes[-1] + size)
+    bands = [
+        _band(row, cumulative_sizes, total_words, band_width)
+        for row in range(len(segment_texts) + 1)
+    ]
+    # The alignment has to start at the beginning of the lyrics and end at the end of the lyrics
+    bands[0] = (0, bands[0][1])
+    bands[-1] = (bands[-1][0], total_words + 1)
+    # Consecutive bands must overlap, otherwise a very long hallucinated segment could make the end unreachable
+    for row in range(1, len(bands)):
+        bands[row] = (min(bands[row][0], bands[row - 1][1] - 1), bands[row][1])
+
+    scores = np.full((len(segment_texts) + 1, total_words + 1), -np.inf)
+    moves = np.full((len(segment_texts) + 1, total_words + 1), _SKIP_WORD)
+    match_starts = np.zeros((len(segment_texts) + 1, total_words + 1), dtype=int)
+    scores[0, 0] = 0
+
+    for row in range(len(segment_texts) + 1):
+        if row > 0:
+            segment = row - 1
+            previous_band = bands[row - 1]
+
+            # skip the segment
+            scores[row, previous_band[0] : previous_band[1]] = scores[
+                row - 1, previous_band[0] : previous_band[1]
+            ]
+            moves[row, previous_band[0] : previous_band[1]] = _SKIP_SEGMENT
+
+            # match the segment with a span of lyrics words
+            for length in (
+                _span_lengths(segment_sizes[segment]) if segment_sizes[segment] else []
+            ):
+                span_scores = score_windows(
+                    lyrics,
+                    segment_texts[segment],
+                    length,
+                    start=previous_band[0],
+                    stop=previous_band[1],
+                )
+                if len(span_scores) == 0:
+                    continue
+
+                starts = np.arange(
+                    previous_band[0], previous_band[0] + len(span_scores)
+                )
+                candidates = (
+                    scores[row - 1, starts]
+                    + (span_scores / 100 - matching_threshold) * segment_sizes[segment]
+                )
+
+                ends = starts + length
+                better = candidates > scores[row, ends]
+                scores[row, ends[better]] = candidates[better]
+                moves[row, ends[better]] = _MATCH
+                match_starts[row, ends[better]] = starts[better]
+
+        # leave lyrics words out of the passages
+        band = bands[row]
+        for position in range(max(band[0], 1), band[1]):
+            skipped = scores[row, position - 1] - word_skip_penalty
+            if skipped > scores[row, position]:
+                scores[row, position] = skipped
+                moves[row, position] = _SKIP_WORD
+
+        # Keep the alignment inside the band
+        scores[row, : band[0]] = -np.inf
+        scores[row, band[1] :] = -np.inf
+
+    known_passages: List[Tuple[int, int]] = [(0, 0)] * len(segment_texts)
+    row, position = len(segment_texts), total_words
+    while row > 0:
+        move = moves[row, position]
+        if move == _SKIP_WORD:
+            position -= 1
+        elif move == _SKIP_SEGMENT:
+            known_passages[row - 1] = (position, position)
+            row -= 1
+        else:
+            start = int(match_starts[row, position])
+            known_passages[row - 1] = (start, position)
+            row, position = row - 1, start
+
+    return known_passages
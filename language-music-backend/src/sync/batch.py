@@ -0,0 +1,186 @@
+import glob
+import json
+import os.path
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+from structlog import get_logger
+
+from src.sound.utils import TRANSCRIPTION_FILE_NAME, LRC_FILE_NAME
+from src.sync import lrc
+from src.sync.instrumentation import collect_sync_stats
+from src.sync.sync import clean_lyrics, extract_known_passages, sync_words
+from src.sync.tokens import tokenize_lyrics
+
+logger = get_logger()
+
+SYNC_ALL_PROGRESS_FILE_NAME = "sync_all_progress.jsonl"
+SYNC_ALL_REPORT_FILE_NAME = "sync_all_report.jsonl"
+
+
+def sync_song_lyrics(lyrics: str, transcription: Dict, mode: str = "greedy") -> str:
+    """
+    Align the scraped lyrics of a song with its whisper transcription and format them as LRC
+
+    :param lyrics: the lyrics as scraped, with HTML and line breaks
+    :param transcription: the whisper transcription of the song
+    :param mode: the matching mode of `extract_known_passages`
+    :return: the content of the LRC file
+    """
+    lyrics_continuous = tokenize_lyrics(clean_lyrics(lyrics))
+    lyrics_with_new_lines = clean_lyrics(lyrics, keep_new_lines=True)
+
+    relevant_segments = transcription["segments"]
+    known_passages = extract_known_passages(
+        relevant_segments, lyrics_continuous, mode=mode
+    )
+    synced_words = sync_words(known_passages, relevant_segments, lyrics_continuous)
+
+    return lrc.apply_formatting(lyrics_with_new_lines, synced_words)
+
+
+def find_transcribed_songs(songs_dir: str = "data/songs") -> List[str]:
+    """
+    :return: the youtube ids of the songs in `songs_dir` that have a transcription
+    """
+    return sorted(
+        os.path.basename(os.path.dirname(path))
+        for path in glob.glob(os.path.join(songs_dir, "*", TRANSCRIPTION_FILE_NAME))
+    )
+
+
+def _sync_song_job(
+    youtube_id: str, lyrics: str, songs_dir: str, mode: str, instrument: bool
+) -> Dict:
+    start = time.perf_counter()
+    song_dir = os.path.join(songs_dir, youtube_id)
+
+    try:
+        with open(os.path.join(song_dir, TRANSCRIPTION_FILE_NAME), "r") as f:
+            transcription = json.load(f)
+
+        with (
+            collect_sync_stats(log=True, youtube_id=youtube_id)
+            if instrument
+            else nullcontext()
+        ):
+            formatted_lrc = sync_song_lyrics(lyrics, transcription, mode=mode)
+
+        # Write to a temporary file first, an interrupted run should never leave a truncated LRC file behind
+        lrc_path = os.path.join(song_dir, LRC_FILE_NAME)
+        with open(lrc_path + ".tmp", "w") as f:
+            f.write(formatted_lrc)
+        os.replace(lrc_path + ".tmp", lrc_path)
+    except Exception as e:
+        return {
+            "youtube_id": youtube_id,
+            "status": "failed",
+            "seconds": time.perf_counter() - start,
+            "error": repr(e),
+        }
+
+    return {
+        "youtube_id": youtube_id,
+        "status": "ok",
+        "seconds": time.perf_counter() - start,
+        "error": None,
+    }
+
+
+def _read_completed_songs(progress_path: str) -> List[str]:
+    if not os.path.exists(progress_path):
+        return []
+
+    completed = []
+    line = ""
+    with open(progress_path, "r") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line might be cut off if the previous run was killed while writing it
+                continue
+            if result["status"] == "ok":
+                completed.append(result["youtube_id"])
+
+    if line and not line.endswith("\n"):
+        # Don't append the next results to the cut off line
+        with open(progress_path, "a") as f:
+            f.write("\n")
+
+    return completed
+
+
+def sync_all_songs(
+    lyrics_by_song: Dict[str, Optional[str]],
+    songs_dir: str = "data/songs",
+    workers: Optional[int] = None,
+    mode: str = "greedy",
+    instrument: bool = False,
+) -> List[Dict]:
+    """
+    Sync the lyrics of many songs across a process pool.
+
+    Every finished song is appended to a progress file in `songs_dir`. When a run is interrupted, the next run skips
+    the songs that were already synced and retries the rest. Once a run completes the progress file becomes the report
+    of the run, and the following run starts from scratch.
+
+    :param lyrics_by_song: the lyrics of each song, by youtube id. Songs without lyrics are reported as failures.
+    :param songs_dir: the directory holding one directory per youtube id
+    :param workers: the number of processes, defaults to the number of CPUs
+    :param mode: the matching mode of `extract_known_passages`
+    :param instrument: log the sync instrumentation of each song, see `collect_sync_stats`
+    :return: one result per song of this run: youtube id, status, seconds and error
+    """
+    progress_path = os.path.join(songs_dir, SYNC_ALL_PROGRESS_FILE_NAME)
+    completed = set(_read_completed_songs(progress_path))
+    if completed:
+        logger.info("Resuming interrupted run", already_synced=len(completed))
+
+    results = []
+    with open(progress_path, "a") as progress, ProcessPoolExecutor(workers) as pool:
+
+        def record(result: Dict):
+            results.append(result)
+            progress.write(json.dumps(result) + "\n")
+            progress.flush()
+            logger.info("Finished syncing song", **result)
+
+        futures = {}
+        for youtube_id, lyrics in lyrics_by_song.items():
+            if youtube_id in completed:
+                continue
+            if not lyrics:
+                record(
+                    {
+                        "youtube_id": youtube_id,
+                        "status": "failed",
+                        "seconds": 0.0,
+                        "error": "No lyrics found",
+                    }
+                )
+                continue
+
+            future = pool.submit(
+                _sync_song_job, youtube_id, lyrics, songs_dir, mode, instrument
+            )
+            futures[future] = youtube_id
+
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died
+                result = {
+                    "youtube_id": futures[future],
+                    "status": "failed",
+                    "seconds": 0.0,
+                    "error": repr(e),
+                }
+            record(result)
+
+    os.replace(progress_path, os.path.join(songs_dir, SYNC_ALL_REPORT_FILE_NAME))
+
+    return results
@@ -0,0 +1,167 @@
+import glob
+import json
+import os.path
+import time
+from typing import Dict, List, Tuple
+
+from src.sync.instrumentation import collect_sync_stats
+from src.sync.sync import (
+    clean_lyrics,
+    extract_known_passages,
+    sync_words,
+    compute_sync_stats,
+)
+from src.sync.tokens import TokenizedLyrics, tokenize_lyrics
+
+LYRICS_FIXTURE_FILE_NAME = "lyrics.txt"
+TRANSCRIPTION_FIXTURE_FILE_NAME = "transcription.json"
+
+
+class _RetokenizingLyrics(TokenizedLyrics):
+    """
+    Reproduces the behaviour before the lyrics were tokenized once: every access splits the raw text again.
+
+    Only used as a reference point when benchmarking.
+    """
+
+    def __init__(self, words: List[str]):
+        super().__init__(words)
+        self.raw = " ".join(words)
+
+    def __len__(self) -> int:
+        return len(self.raw.split())
+
+    def join(self, start: int, end: int) -> str:
+        return " ".join(self.raw.split()[start:end])
+
+    def slice(self, start: int, end: int) -> "TokenizedLyrics":
+        return _RetokenizingLyrics(self.raw.split()[start:end])
+
+
+def load_sync_fixture(fixture_dir: str) -> Tuple[str, Dict]:
+    with open(os.path.join(fixture_dir, LYRICS_FIXTURE_FILE_NAME), "r") as f:
+        lyrics = f.read()
+    with open(os.path.join(fixture_dir, TRANSCRIPTION_FIXTURE_FILE_NAME), "r") as f:
+        data = json.load(f)
+
+    return lyrics, data
+
+
+def _time_sync(segments: List[Dict], lyrics: TokenizedLyrics, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        known_passages = extract_known_passages(segments, lyrics)
+        sync_words(known_passages, segments, lyrics)
+
+    return (time.perf_counter() - start) / repeat
+
+
+def benchmark_tokenization(fixture_dir: str, repeat: int = 10) -> Dict[str, float]:
+    """
+    Compare the sync pipeline on pre-tokenized lyrics against re-splitting the lyrics on every window.
+
+    :param fixture_dir: directory holding a `lyrics.txt` and a `transcription.json`
+    :param repeat: how many times to run the pipeline for each variant
+    :return: the average seconds per run for each variant, and the speedup
+    """
+    lyrics, data = load_sync_fixture(fixture_dir)
+    words = clean_lyrics(lyrics).split()
+
+    retokenizing = _time_sync(data["segments"], _RetokenizingLyrics(words), repeat)
+    tokenized = _time_sync(data["segments"], TokenizedLyrics(words), repeat)
+
+    return {
+        "retokenizing_seconds": retokenizing,
+        "tokenized_seconds": tokenized,
+        "speedup": retokenizing / tokenized,
+    }
+
+
+def find_sync_fixtures(fixtures_dir: str) -> List[str]:
+    """
+    :return: the directories under `fixtures_dir` holding both a `lyrics.txt` and a `transcription.json`
+    """
+    return sorted(
+        os.path.dirname(path)
+        for path in glob.glob(
+            os.path.join(fixtures_dir, "*", TRANSCRIPTION_FIXTURE_FILE_NAME)
+        )
+        if os.path.exists(os.path.join(os.path.dirname(path), LYRICS_FIXTURE_FILE_NAME))
+    )
+
+
+def _run_pipeline(
+    lyrics: str, segments: List[Dict], mode: str
+) -> Tuple[List[Tuple[int, int]], List[List[Tuple[float, float]]], TokenizedLyrics]:
+    just_lyrics = tokenize_lyrics(clean_lyrics(lyrics))
+    known_passages = extract_known_passages(segments, just_lyrics, mode=mode)
+    synced_words = sync_words(known_passages, segments, just_lyrics)
+
+    return known_passages, synced_words, just_lyrics
+
+
+def benchmark_song(fixture_dir: str, mode: str = "greedy", repeat: int = 1) -> Dict:
+    """
+    Run clean_lyrics -> extract_known_passages -> sync_words on one fixture
+
+    :return: the average wall time, the fuzzy match calls of one run and the coverage statistics
+    """
+    lyrics, data = load_sync_fixture(fixture_dir)
+
+    with collect_sync_stats() as stats:
+        known_passages, synced_words, just_lyrics = _run_pipeline(
+            lyrics, data["segments"], mode
+        )
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        _run_pipeline(lyrics, data["segments"], mode)
+    seconds = (time.perf_counter() - start) / repeat
+
+    return {
+        "song": os.path.basename(os.path.normpath(fixture_dir)),
+        "seconds": seconds,
+        **stats.to_dict(),
+        **compute_sync_stats(known_passages, just_lyrics),
+        "segments": len(data["segments"]),
+        "synced_words": sum(len(part) for part in synced_words),
+    }
+
+
+def benchmark_corpus(fixtures_dir: str, mode: str = "greedy", repeat: int = 1) -> Dict:
+    """
+    Benchmark every fixture under `fixtures_dir`. The result is meant to be dumped as JSON and compared between commits
+    with `compare_benchmarks`.
+    """
+    songs = [
+        benchmark_song(fixture_dir, mode=mode, repeat=repeat)
+        for fixture_dir in find_sync_fixtures(fixtures_dir)
+    ]
+
+    return {
+        "mode": mode,
+        "repeat": repeat,
+        "total_seconds": sum(song["seconds"] for song in songs),
+        "songs": songs,
+    }
+
+
+def compare_benchmarks(current: Dict, baseline: Dict) -> List[Dict]:
+    """
+    :return: for each song in both benchmarks, the change of the timing, the fuzzy match calls and the coverage
+    """
+    baseline_songs = {song["song"]: song for song in baseline["songs"]}
+
+    return [
+        {
+            "song": song["song"],
+            "seconds_ratio": song["seconds"] / baseline_songs[song["song"]]["seconds"],
+            "fuzzy_match_calls_delta": song["fuzzy_match_calls"]
+            - baseline_songs[song["song"]]["fuzzy_match_calls"],
+            "max_gap_delta": song["max_gap"] - baseline_songs[song["song"]]["max_gap"],
+            "missed_segments_delta": song["missed_segments"]
+            - baseline_songs[song["song"]]["missed_segments"],
+        }
+        for song in current["songs"]
+        if song["song"] in baseline_songs
+    ]
@@ -0,0 +1,128 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from structlog import get_logger
+
+logger = get_logger()
+
+
+class SyncStats:
+    """
+    Counters collected while syncing, see `collect_sync_stats`
+    """
+
+    def __init__(self):
+        self.fuzzy_match_calls = 0
+        self.windows_per_segment: List[int] = []
+        # The searches of the words of a segment within its passage, see `word_level_search`
+        self.windows_per_word: List[int] = []
+        self.word_level = False
+        self.max_recursion_depth = 0
+        self.stage_seconds: Dict[str, float] = {}
+        self.active_stages = set()
+
+    def summary(self) -> dict:
+        return {
+            "fuzzy_match_calls": self.fuzzy_match_calls,
+            "searched_segments": len(self.windows_per_segment),
+            "max_windows_per_segment": max(self.windows_per_segment, default=0),
+            "searched_words": len(self.windows_per_word),
+            "max_recursion_depth": self.max_recursion_depth,
+            "stage_seconds": self.stage_seconds,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            **self.summary(),
+            "windows_per_segment": self.windows_per_segment,
+            "windows_per_word": self.windows_per_word,
+        }
+
+
+_current_stats: ContextVar[Optional[SyncStats]] = ContextVar("sync_stats", default=None)
+
+
+@contextmanager
+def collect_sync_stats(log: bool = False, **log_context) -> Iterator[SyncStats]:
+    """
+    Count what the sync engine does inside the block. Outside of it nothing is counted.
+
+    :param log: emit the collected stats through the logger when the block exits
+    :param log_context: extra fields for the log line, for example the song id
+    """
+    stats = SyncStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+        if log:
+            logger.info("Sync instrumentation", **log_context, **stats.summary())
+
+
+def count_fuzzy_matches(count: int = 1):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.fuzzy_match_calls += count
+
+
+def record_segment_windows(count: int):
+    """
+    Record how many windows were scored while searching for one segment, or for one word inside a
+    `word_level_search` block
+    """
+    stats = _current_stats.get()
+    if stats is not None:
+        if stats.word_level:
+            stats.windows_per_word.append(count)
+        else:
+            stats.windows_per_segment.append(count)
+
+
+@contextmanager
+def word_level_search() -> Iterator[None]:
+    """
+    The searches inside the block map the words of one segment, record their windows apart from those of the segments
+    """
+    stats = _current_stats.get()
+    if stats is None or stats.word_level:
+        yield
+        return
+
+    stats.word_level = True
+    try:
+        yield
+    finally:
+        stats.word_level = False
+
+
+def record_recursion_depth(depth: int):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.max_recursion_depth = max(stats.max_recursion_depth, depth)
+
+
+@contextmanager
+def time_stage(name: str) -> Iterator[None]:
+    """
+    Add the time spent in the block to the stage.
+
+    Stages are inclusive: the time of a stage nested in another one is counted in both. A stage nested in itself (the
+    recursive gap search) is only counted once.
+    """
+    stats = _current_stats.get()
+    if stats is None or name in stats.active_stages:
+        yield
+        return
+
+    stats.active_stages.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.active_stages.remove(name)
+        stats.stage_seconds[name] = (
+            stats.stage_seconds.get(name, 0.0) + time.perf_counter() - start
+        )
@@ -0,0 +1,92 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from src.sync.instrumentation import count_fuzzy_matches
+from src.sync.tokens import TokenizedLyrics
+
+
+def score_windows(
+    lyrics: TokenizedLyrics,
+    segment_text: str,
+    window_size: int,
+    start: int = 0,
+    stop: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Score every window of `window_size` words, starting at `start`, against the segment text in a single call.
+
+    The scores are the same as calling `thefuzz.fuzz.ratio` on each window: rapidfuzz computes the ratio and thefuzz
+    only rounds it to an integer.
+
+    :param lyrics:
+    :param segment_text:
+    :param window_size: the number of lyrics words in each window
+    :param start: the index of the first window
+    :param stop: if given, windows start strictly before this index
+    :return: the score of the window starting at `start + i` at index `i`
+    """
+    last_start = len(lyrics) - window_size + 1
+    if stop is not None:
+        last_start = min(last_start, stop)
+
+    windows = [lyrics.join(i, i + window_size) for i in range(start, last_start)]
+    if not windows:
+        return np.empty(0)
+
+    count_fuzzy_matches(len(windows))
+
+    # float64 so the rounding matches thefuzz, which rounds the python float returned by rapidfuzz
+    scores = process.cdist(
+        [segment_text], windows, scorer=fuzz.ratio, dtype=np.float64
+    )[0]
+
+    return np.round(scores)
+
+
+class SegmentScorer:
+    """
+    Fuzzy scores of one segment against windows of the lyrics, cached by (start, end).
+
+    `search_for_segment` scores all the windows of one size in a batch, and the exploration around the best passage
+    then reuses those scores instead of computing them again.
+    """
+
+    def __init__(self, lyrics: TokenizedLyrics, segment_text: str):
+        self.lyrics = lyrics
+        self.segment_text = segment_text
+        self.scores: Dict[Tuple[int, int], float] = {}
+        # window size -> (index of the first window, scores of the batch)
+        self.batches: Dict[int, Tuple[int, np.ndarray]] = {}
+        self.windows_scored = 0
+
+    def score_windows(
+        self, window_size: int, start: int = 0, stop: Optional[int] = None
+    ) -> np.ndarray:
+        scores = score_windows(
+            self.lyrics, self.segment_text, window_size, start=start, stop=stop
+        )
+        self.batches[window_size] = (start, scores)
+        self.windows_scored += len(scores)
+
+        return scores
+
+    def score(self, start: int, end: int) -> float:
+        """
+        Same as `thefuzz.fuzz.ratio(lyrics.join(start, end), segment_text)`, computed at most once per window
+        """
+        window = (start, end)
+        if window in self.scores:
+            return self.scores[window]
+
+        first_start, batch = self.batches.get(end - start, (0, []))
+        if first_start <= start < first_start + len(batch):
+            score = batch[start - first_start]
+        else:
+            count_fuzzy_matches()
+            self.windows_scored += 1
+            score = round(fuzz.ratio(self.lyrics.join(start, end), self.segment_text))
+
+        self.scores[window] = score
+        return score
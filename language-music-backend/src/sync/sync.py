@@ -1,9 +1,19 @@
 import json
 import math
 import re
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Union
 
-from thefuzz import fuzz
+import numpy as np
+
+from src.sync.alignment import align_passages_dp
+from src.sync.instrumentation import (
+    time_stage,
+    record_segment_windows,
+    record_recursion_depth,
+    word_level_search,
+)
+from src.sync.scoring import SegmentScorer
+from src.sync.tokens import TokenizedLyrics, tokenize_lyrics
 
 
 def read_toy_lyrics_data() -> Tuple[Dict, str]:
@@ -40,23 +50,21 @@ def clean_lyrics(lyrics: str, keep_new_lines=False) -> str:
 
 
 def __explore_around_passage(
-    lyrics: str,
-    segment_text: str,
+    scorer: SegmentScorer,
     longest_passage: Tuple[int, int],
     start: int = 0,
 ) -> Tuple[int, int]:
     """
     Given a passage, explore around it to see if there is a longer / shorter passage that has a higher score
+
+    The scorer caches every window it scored, so windows already scored while searching are not scored again.
     """
-    max_score = fuzz.ratio(
-        " ".join(lyrics.split()[longest_passage[0] : longest_passage[1]]), segment_text
-    )
+    max_score = scorer.score(longest_passage[0], longest_passage[1])
 
     # remove tokens from the left until the score decreases
     while longest_passage[0] < longest_passage[1]:
         new_start = longest_passage[0] + 1
-        new_passage = " ".join(lyrics.split()[new_start : longest_passage[1]])
-        new_score = fuzz.ratio(new_passage, segment_text)
+        new_score = scorer.score(new_start, longest_passage[1])
 
         if new_score < max_score:
             break
@@ -67,8 +75,7 @@ def __explore_around_passage(
     # remove tokens from the right until the score decreases
     while longest_passage[0] < longest_passage[1]:
         new_end = longest_passage[1] - 1
-        new_passage = " ".join(lyrics.split()[longest_passage[0] : new_end])
-        new_score = fuzz.ratio(new_passage, segment_text)
+        new_score = scorer.score(longest_passage[0], new_end)
 
         if new_score < max_score:
             break
@@ -79,8 +86,7 @@ def __explore_around_passage(
     # prepend tokens to the left until the score decreases
     while longest_passage[0] > start:
         new_start = longest_passage[0] - 1
-        new_passage = " ".join(lyrics.split()[new_start : longest_passage[1]])
-        new_score = fuzz.ratio(new_passage, segment_text)
+        new_score = scorer.score(new_start, longest_passage[1])
 
         if new_score < max_score:
             break
@@ -89,10 +95,9 @@ def __explore_around_passage(
         max_score = new_score
 
     # append tokens to the right until the score decreases
-    while longest_passage[1] < len(lyrics.split()):
+    while longest_passage[1] < len(scorer.lyrics):
         new_end = longest_passage[1] + 1
-        new_passage = " ".join(lyrics.split()[longest_passage[0] : new_end])
-        new_score = fuzz.ratio(new_passage, segment_text)
+        new_score = scorer.score(longest_passage[0], new_end)
 
         if new_score < max_score:
             break
@@ -104,49 +109,39 @@ def __explore_around_passage(
 
 
 def search_for_segment(
-    lyrics: str, segment_text: str, start: int = 0, matching_threshold: int = 75
+    lyrics: Union[str, TokenizedLyrics],
+    segment_text: str,
+    start: int = 0,
+    matching_threshold: int = 75,
 ) -> Tuple[int, int]:
     """
     Search for a segment in the lyrics, starting at the given index
-    :param lyrics:
+    :param lyrics: the lyrics, either as plain text or already tokenized
     :param segment_text:
     :param start:
     :param matching_threshold:
     :return:
     """
-    total_words = len(lyrics.split())
+    lyrics = tokenize_lyrics(lyrics)
+    total_words = len(lyrics)
 
-    current_passage_start = start
     segment_size = len(segment_text.split())
 
     # Maybe whisper splits some words
     # For example we don't want to skip if the segment size if 6 and the total words count is 5
     # This happens when we recursively search through the gaps after the first iteration on the full lyrics
-    window_size = max(len(segment_text.split()) - math.ceil(segment_size / 5), 1)
+    window_size = max(segment_size - math.ceil(segment_size / 5), 1)
     if window_size + start > total_words:
         # How?
         # Whisper hallucinates with very long sequences of words, we just skip those.
         return start, start
 
-    score_matrix = {}
+    # All the windows are scored in a single call, instead of one fuzz.ratio call per window
+    scorer = SegmentScorer(lyrics, segment_text)
+    with time_stage("window_scan"):
+        passage_scores = scorer.score_windows(window_size, start=start)
 
-    while current_passage_start < len(lyrics.split()) - window_size + 1:
-        current_passage_end = current_passage_start + window_size
-        current_passage = " ".join(
-            lyrics.split()[current_passage_start:current_passage_end]
-        )
-
-        passage_score = fuzz.ratio(current_passage, segment_text)
-        # Adjust the score to favor passages that are closer to the start of the lyrics
-        passage_score = passage_score * (
-            1 - (current_passage_start - start) / (len(lyrics.split()) - start) * 0.2
-        )
-
-        score_matrix[(current_passage_start, current_passage_end)] = passage_score
-
-        current_passage_start += 1
-
-    if not score_matrix:
+    if len(passage_scores) == 0:
         """
         This happens when the transformer hallucinates something at the end of the song.
 
@@ -154,37 +149,44 @@ def search_for_segment(
         from pydub, to make sure we allow for the word to start and finish properly. This might allow some space for
         the transformer to hallucinate though.
         """
+        record_segment_windows(0)
         return start, start
 
+    # Adjust the score to favor passages that are closer to the start of the lyrics
+    passage_starts = np.arange(start, start + len(passage_scores))
+    passage_scores = passage_scores * (
+        1 - (passage_starts - start) / (total_words - start) * 0.2
+    )
+
     # find the max score
-    max_score = max(score_matrix.values())
+    max_score = passage_scores.max()
 
     if max_score < matching_threshold:
         # If the max score is too low, we don't want to return anything
+        record_segment_windows(scorer.windows_scored)
         return start, start
 
-    # Get the passage with the max score, and the lowest start index, but longest length
-    longest_passage = min(
-        [k for k, v in score_matrix.items() if v == max_score],
-        key=lambda x: x[0] * 1000 - (x[1] - x[0]),
-    )
-    longest_passage = __explore_around_passage(
-        lyrics, segment_text, longest_passage, start=start
-    )
+    # Get the passage with the max score and the lowest start index. All the windows have the same length, and argmax
+    # returns the first occurrence of the max.
+    best_start = start + int(np.argmax(passage_scores))
+    longest_passage = (best_start, best_start + window_size)
+    with time_stage("explore"):
+        longest_passage = __explore_around_passage(scorer, longest_passage, start=start)
+    record_segment_windows(scorer.windows_scored)
 
     return longest_passage
 
 
 def __identify_gaps(
-    known_passages: List[Tuple[int, int]], lyrics: str
+    known_passages: List[Tuple[int, int]], lyrics: TokenizedLyrics
 ) -> List[Tuple[int, int]]:
     gaps = [
         (known_passages[i][1], known_passages[i + 1][0])
         for i in range(len(known_passages) - 1)
         if known_passages[i + 1][0] - known_passages[i][1] > 0
     ]
-    if known_passages[-1][1] < len(lyrics.split()):
-        gaps.append((known_passages[-1][1], len(lyrics.split())))
+    if known_passages[-1][1] < len(lyrics):
+        gaps.append((known_passages[-1][1], len(lyrics)))
 
     if known_passages[0][0] > 0:
         gaps.append((0, known_passages[0][0]))
@@ -193,8 +195,12 @@ def __identify_gaps(
 
 
 def __recursively_map_passages(
-    relevant_segments: List[Dict], lyrics: str, recursive_ttl: int = 3
+    relevant_segments: List[Dict],
+    lyrics: TokenizedLyrics,
+    recursive_ttl: int = 3,
+    depth: int = 0,
 ) -> List[Tuple[int, int]]:
+    record_recursion_depth(depth)
     known_passages = []
     for segment in relevant_segments:
         longest_passage = search_for_segment(
@@ -233,12 +239,14 @@ def __recursively_map_passages(
         if len(segments) == 0:
             continue
 
-        partial_lyrics = " ".join(lyrics.split()[gap[0] : gap[1]])
-        gap_known_passages = __recursively_map_passages(
-            relevant_segments=[relevant_segments[s] for s in segments],
-            lyrics=partial_lyrics,
-            recursive_ttl=recursive_ttl - 1,
-        )
+        partial_lyrics = lyrics.slice(gap[0], gap[1])
+        with time_stage("gap_recursion"):
+            gap_known_passages = __recursively_map_passages(
+                relevant_segments=[relevant_segments[s] for s in segments],
+                lyrics=partial_lyrics,
+                recursive_ttl=recursive_ttl - 1,
+                depth=depth + 1,
+            )
 
         p: Tuple[int, int]  # The IDE needs this type hint otherwise thinks p is an int
         for i, p in enumerate(gap_known_passages):
@@ -248,16 +256,35 @@ def __recursively_map_passages(
 
 
 def extract_known_passages(
-    relevant_segments: List[Dict], lyrics: str
+    relevant_segments: List[Dict],
+    lyrics: Union[str, TokenizedLyrics],
+    mode: str = "greedy",
 ) -> List[Tuple[int, int]]:
-    known_passages = __recursively_map_passages(relevant_segments, lyrics)
+    """
+    Find the passage of the lyrics that corresponds to each segment
+
+    :param relevant_segments:
+    :param lyrics: the lyrics, either as plain text or already tokenized
+    :param mode: "greedy" searches the segments left to right and then recursively through the gaps, "dp" aligns all
+        the segments at once with a banded dynamic programming pass
+    :return:
+    """
+    lyrics = tokenize_lyrics(lyrics)
+    if mode == "greedy":
+        with time_stage("map_passages"):
+            known_passages = __recursively_map_passages(relevant_segments, lyrics)
+    elif mode == "dp":
+        with time_stage("dp_alignment"):
+            known_passages = align_passages_dp(relevant_segments, lyrics)
+    else:
+        raise ValueError(f"Unknown matching mode: {mode}")
 
     missed_segment_starts = [
         known_passages[i][0]
         for i in range(len(known_passages))
         if known_passages[i][1] - known_passages[i][0] == 0
     ]
-    if not missed_segment_starts or missed_segment_starts[0] == len(lyrics.split()):
+    if not missed_segment_starts or missed_segment_starts[0] == len(lyrics):
         """
         What this means:
 
@@ -274,16 +301,21 @@ def extract_known_passages(
     return known_passages
 
 
+@time_stage("sync_words")
 def sync_words(
-    known_passages: List[Tuple[int, int]], relevant_segments: List[Dict], lyrics: str
+    known_passages: List[Tuple[int, int]],
+    relevant_segments: List[Dict],
+    lyrics: Union[str, TokenizedLyrics],
 ) -> List[List[Tuple[float, float]]]:
     """
     For each word in the lyrics assign a start and an end time
 
     :param known_passages:
     :param relevant_segments:
+    :param lyrics: the lyrics, either as plain text or already tokenized
     :return:
     """
+    lyrics = tokenize_lyrics(lyrics)
     if len(known_passages) != len(relevant_segments):
         raise Exception(
             "Number of known passages does not match number of relevant segments"
@@ -294,9 +326,7 @@ def sync_words(
         segment_length = len(relevant_segments[i]["words"])
 
         stt_words = [w for w in relevant_segments[i]["words"]]
-        lyric_words = " ".join(
-            lyrics.split()[known_passages[i][0] : known_passages[i][1]]
-        )
+        lyric_words = lyrics.slice(known_passages[i][0], known_passages[i][1])
 
         if known_passages[i][1] - known_passages[i][0] == segment_length:
             """
@@ -313,21 +343,23 @@ def sync_words(
             Map the lyrics words to the STT words. For segments where multiple lyrics words are mapped to a segment
             word we split the time between the words.
             """
-            words_known_passages = extract_known_passages(stt_words, lyric_words)
+            with word_level_search():
+                words_known_passages = extract_known_passages(stt_words, lyric_words)
             # We don't want to loose any words at the end of the verse
-            if words_known_passages[-1][1] != len(lyric_words.split()):
+            if words_known_passages[-1][1] != len(lyric_words):
                 words_known_passages[-1] = (
                     words_known_passages[-1][0],
-                    len(lyric_words.split()),
+                    len(lyric_words),
                 )
         else:
             """
             The STT module detected more words than we have in the lyrics.
             We simply skip the ones that don't have a match in the lyrics.
             """
-            words_known_passages: List[Tuple[int, int]] = extract_known_passages(
-                stt_words, lyric_words
-            )
+            with word_level_search():
+                words_known_passages: List[Tuple[int, int]] = extract_known_passages(
+                    stt_words, lyric_words
+                )
             """
             Tricky example: 
             Detected by Whisper: Ser i dig, ser i dig dit
@@ -406,26 +438,51 @@ def sync_words(
     return word_timestamps
 
 
+def compute_sync_stats(
+    known_passages: List[Tuple[int, int]], lyrics: Union[str, TokenizedLyrics]
+) -> Dict:
+    """
+    Coverage statistics of the known passages
+
+    :param known_passages:
+    :param lyrics:
+    :return: the largest gap between consecutive passages, the last covered index, the number of lyrics words and the
+        number of segments without a passage
+    """
+    lyrics = tokenize_lyrics(lyrics)
+
+    return {
+        "max_gap": max(
+            [
+                known_passages[i + 1][0] - known_passages[i][1]
+                for i in range(len(known_passages) - 1)
+            ],
+            default=0,
+        ),
+        "last_covered_index": known_passages[-1][1] if known_passages else 0,
+        "total_words": len(lyrics),
+        "missed_segments": len([p for p in known_passages if p[1] - p[0] == 0]),
+    }
+
+
 def print_sync_stats_debug(
-    known_passages: List[Tuple[int, int]], relevant_segments: List[Dict], lyrics: str
+    known_passages: List[Tuple[int, int]],
+    relevant_segments: List[Dict],
+    lyrics: Union[str, TokenizedLyrics],
 ):
+    lyrics = tokenize_lyrics(lyrics)
     for i in range(len(known_passages)):
         print(known_passages[i])
-        print(" ".join(lyrics.split()[known_passages[i][0] : known_passages[i][1]]))
+        print(lyrics.join(known_passages[i][0], known_passages[i][1]))
         print(relevant_segments[i]["text"].strip())
         print("\n")
 
-    max_gap = max(
-        [
-            known_passages[i + 1][0] - known_passages[i][1]
-            for i in range(len(known_passages) - 1)
-        ]
-    )
+    stats = compute_sync_stats(known_passages, lyrics)
     print(
         "Covered up to index",
-        known_passages[-1][1],
+        stats["last_covered_index"],
         "out of",
-        len(lyrics.split()),
+        stats["total_words"],
         ", max gap:",
-        max_gap,
+        stats["max_gap"],
     )
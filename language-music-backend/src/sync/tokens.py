@@ -0,0 +1,49 @@
+from typing import List, Union
+
+
+class TokenizedLyrics:
+    """
+    Lyrics split into words once, so the sync engine can slice and join windows without re-tokenizing the text.
+
+    The words are kept together with their character offsets in `text`, the single-space joined version of the
+    lyrics. Joining a window of words is then a single string slice.
+    """
+
+    def __init__(self, words: List[str]):
+        self.words = words
+        self.text = " ".join(words)
+
+        self.offsets = []
+        offset = 0
+        for word in words:
+            self.offsets.append(offset)
+            offset += len(word) + 1
+
+    @classmethod
+    def from_text(cls, lyrics: str) -> "TokenizedLyrics":
+        return cls(lyrics.split())
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def join(self, start: int, end: int) -> str:
+        """
+        Equivalent to `" ".join(lyrics.split()[start:end])`
+        """
+        end = min(end, len(self.words))
+        if start >= end:
+            return ""
+
+        return self.text[
+            self.offsets[start] : self.offsets[end - 1] + len(self.words[end - 1])
+        ]
+
+    def slice(self, start: int, end: int) -> "TokenizedLyrics":
+        return TokenizedLyrics(self.words[start:end])
+
+
+def tokenize_lyrics(lyrics: Union[str, TokenizedLyrics]) -> TokenizedLyrics:
+    if isinstance(lyrics, TokenizedLyrics):
+        return lyrics
+
+    return TokenizedLyrics.from_text(lyrics)
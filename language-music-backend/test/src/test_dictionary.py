@@ -0,0 +1,92 @@
+import os.path
+import tempfile
+import unittest
+
+from src.dictionary import (
+    Dictionary,
+    DictionaryCache,
+    load_dictionary_for_language,
+    write_compiled_dictionary,
+    MappedDictionary,
+    NeighbourIndex,
+)
+
+
+class DictionaryTest(unittest.TestCase):
+    def test_case_folded_membership(self):
+        dictionary = load_dictionary_for_language("fr")
+
+        self.assertIn("route", dictionary)
+        self.assertIn("Route", dictionary)
+        self.assertIn("ROUTE", dictionary)
+        self.assertNotIn("routexyz", dictionary)
+
+    def test_shared_between_loads(self):
+        self.assertIs(
+            load_dictionary_for_language("sv"), load_dictionary_for_language("sv")
+        )
+
+    def test_mapped_dictionary(self):
+        words = ["route", "Été", "zèbre", "Abricot", "été"]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "fr.dict")
+            write_compiled_dictionary(words, path)
+            dictionary = MappedDictionary(path)
+
+            self.assertEqual(len(dictionary), len(words))
+            self.assertEqual(sorted(dictionary), sorted(words))
+            self.assertIn("ROUTE", dictionary)
+            self.assertIn("été", dictionary)
+            self.assertIn("abricot", dictionary)
+            self.assertNotIn("rout", dictionary)
+            self.assertNotIn("zzz", dictionary)
+            self.assertEqual(dictionary[0], "Abricot")
+
+    def test_neighbour_index(self):
+        index = NeighbourIndex(["route", "Route", "routes", "doute", "rte", "chanson"])
+
+        self.assertEqual(sorted(index.neighbours("route")), ["doute", "routes", "rte"])
+        self.assertEqual(
+            sorted(index.neighbours("route", max_distance=1)), ["doute", "routes"]
+        )
+        self.assertEqual(len(index.sample_neighbours("route", 2)), 2)
+        self.assertEqual(index.sample_neighbours("xyzxyzxyz", 2), [])
+
+    def test_mapped_neighbour_index(self):
+        words = ["route", "Route", "routes", "doute", "rte", "chanson", "été"]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "fr.dict")
+            write_compiled_dictionary(words, path)
+            dictionary = MappedDictionary(path)
+
+            self.assertEqual(
+                sorted(dictionary.words_of_length(5)), ["Route", "doute", "route"]
+            )
+            self.assertEqual(dictionary.words_of_length(40), [])
+
+            index = NeighbourIndex(dictionary)
+            self.assertEqual(index.estimated_bytes(), 0)
+            self.assertEqual(
+                sorted(index.neighbours("route")), ["doute", "routes", "rte"]
+            )
+            # Only the lengths around the word are decoded
+            self.assertEqual(sorted(index.buckets), [3, 4, 5, 6, 7])
+            self.assertGreater(index.estimated_bytes(), 0)
+
+    def test_cache_evicts_least_recently_used(self):
+        dictionaries = {
+            language: Dictionary([f"{language}{i}" for i in range(100)])
+            for language in ["en", "fr", "sv"]
+        }
+        budget = dictionaries["en"].estimated_bytes() * 2
+        cache = DictionaryCache(budget, loader=dictionaries.get)
+
+        self.assertIs(cache.dictionary("en"), dictionaries["en"])
+        cache.dictionary("fr")
+        cache.dictionary("en")
+        cache.dictionary("sv")
+
+        self.assertEqual(list(cache.languages), ["en", "sv"])
+        self.assertLessEqual(cache.estimated_bytes(), budget)
+        self.assertIn("fr3", cache.neighbour_index("fr").neighbours("fr33"))
+        self.assertEqual(list(cache.languages), ["fr"])
@@ -24,7 +24,83 @@ def _process_song(input_file: str) -> Tuple[ProcessedSong, SongProcessor]:
     return processed_song, song_processor
 
 
+SUR_MA_ROUTE = SongWithLanguage(
+    spotify_id="sur-ma-route",
+    language="fr",
+    lyrics="[Refrain]<br/>Sur ma route, oui, il y a eu du move, oui<br/>"
+    "De l'aventure dans l'movie, une vie de roots<br/>"
+    "Sur ma route, oui, je n'compte plus les soucis<br/>"
+    "De quoi devenir fou, oui, une vie de roots<br/><br/>[Couplet 1]<br/>"
+    "Sur ma route, j'ai eu des moments de doute<br/>"
+    "J'marchais sans savoir vers où, j'étais têtu rien à foutre<br/>"
+    "Sur ma route, j'avais pas d'bagage en soute<br/>"
+    "Et dans ma poche, pas un sou, juste la famille, entre nous<br/>"
+    "Sur ma route, y a eu un tas d'bouchons<br/>"
+    "La vérité, j'ai souvent trébuché",
+)
+
+
 class ProcessorTest(unittest.TestCase):
+    def test_french_song(self):
+        song_processor = SongProcessor(SUR_MA_ROUTE)
+
+        processed_song = (
+            song_processor.create_line_reordering_task()
+            .create_word_selection_task()
+            .create_word_selection_task()
+            .create_word_selection_task()
+            .mask_words_according_to_tasks()
+            .get_processed_song()
+        )
+
+        self.assertEqual(len(processed_song.word_selection_tasks), 3)
+        for task in processed_song.word_selection_tasks:
+            self.assertIn(task.target_word, task.alternatives)
+            self.assertIn(f"__wst{task.task_id}__", processed_song.processed_lyrics)
+        self.assertIn("__lrt0__", processed_song.processed_lyrics)
+        self.assertNotIn(
+            processed_song.line_reordering_tasks[0].original_line,
+            processed_song.processed_lyrics,
+        )
+
+    def test_french_song_variants(self):
+        song_processor = SongProcessor(SUR_MA_ROUTE)
+
+        variants = song_processor.create_variants(4, word_selection_tasks=2)
+
+        self.assertEqual(len(variants), 4)
+        for variant in variants:
+            self.assertEqual(len(variant.word_selection_tasks), 2)
+            self.assertEqual(len(variant.line_reordering_tasks), 1)
+            self.assertEqual(variant.word_selection_tasks[-1].task_id, 1)
+            self.assertIn("__lrt0__", variant.processed_lyrics)
+            self.assertNotIn("__lrt1__", variant.processed_lyrics)
+
+    def test_nested_target_words(self):
+        song = SongWithLanguage(
+            spotify_id="routes",
+            language="fr",
+            lyrics="Toutes les routes mènent ailleurs<br/>Sur la route des vacances",
+        )
+
+        song_processor = SongProcessor(song).create_word_selection_task("routes")
+        self.assertNotIn("route", song_processor.candidate_words)
+
+        # Forced, "route" still gets its marker when it only appears inside "routes"
+        song = song.model_copy(
+            update={"lyrics": "Toutes les routes mènent ailleurs<br/>Sur le chemin"}
+        )
+        processed_song = (
+            SongProcessor(song)
+            .create_word_selection_task("routes")
+            .create_word_selection_task("route")
+            .mask_words_according_to_tasks()
+            .get_processed_song()
+        )
+        self.assertNotIn("route", processed_song.processed_lyrics)
+        self.assertIn("__wst0__", processed_song.processed_lyrics)
+        self.assertIn("__wst1__", processed_song.processed_lyrics)
+
     def test_word_replacement_duplicate_words(self):
         with open("test/data/viva_la_dealer.json", "r") as f:
             song_json = json.load(f)
@@ -0,0 +1,79 @@
+import json
+import os.path
+import tempfile
+import unittest
+
+from src.sound.profiling import PROFILE_FILE_NAME, StageProfiler, aggregate_profiles
+
+
+class StageProfilerTest(unittest.TestCase):
+    def test_records_stages(self):
+        with tempfile.TemporaryDirectory() as working_dir:
+            profiler = StageProfiler(working_dir, audio_seconds=lambda: 200.0)
+            profiler.run("split", lambda: sum(range(100000)))
+
+            with open(os.path.join(working_dir, PROFILE_FILE_NAME), "r") as f:
+                profile = json.load(f)
+
+            self.assertEqual(200.0, profile["audio_seconds"])
+            measure = profile["stages"]["split"]
+            self.assertGreater(measure["wall_seconds"], 0)
+            self.assertGreater(measure["peak_rss_bytes"], 0)
+            self.assertAlmostEqual(
+                measure["wall_seconds"] / 200.0, measure["real_time_factor"]
+            )
+
+            # A later run only replaces the stages it runs
+            StageProfiler(working_dir).run("transcribe", lambda: None)
+            with open(os.path.join(working_dir, PROFILE_FILE_NAME), "r") as f:
+                profile = json.load(f)
+            self.assertEqual({"split", "transcribe"}, set(profile["stages"]))
+
+    def test_failed_stage_not_recorded(self):
+        def fail():
+            raise ValueError()
+
+        with tempfile.TemporaryDirectory() as working_dir:
+            with self.assertRaises(ValueError):
+                StageProfiler(working_dir).run("split", fail)
+
+            self.assertFalse(
+                os.path.exists(os.path.join(working_dir, PROFILE_FILE_NAME))
+            )
+
+    def test_aggregate(self):
+        with tempfile.TemporaryDirectory() as songs_dir:
+            for song, audio_seconds in [("a", 100.0), ("b", 300.0)]:
+                os.makedirs(os.path.join(songs_dir, song))
+                with open(os.path.join(songs_dir, song, PROFILE_FILE_NAME), "w") as f:
+                    json.dump(
+                        {
+                            "audio_seconds": audio_seconds,
+                            "stages": {
+                                stage: {
+                                    "wall_seconds": wall_seconds,
+                                    "cpu_seconds": 2 * wall_seconds,
+                                    "peak_rss_bytes": 1000,
+                                    "peak_rss_reset": True,
+                                    "real_time_factor": wall_seconds / audio_seconds,
+                                }
+                                for stage, wall_seconds in [
+                                    ("extract_voice", audio_seconds),
+                                    ("transcribe", audio_seconds / 4),
+                                ]
+                            },
+                        },
+                        f,
+                    )
+
+            report = aggregate_profiles(songs_dir)
+
+            self.assertEqual(2, report["songs"])
+            self.assertEqual(400.0, report["audio_seconds"])
+            self.assertAlmostEqual(0.8, report["stages"]["extract_voice"]["wall_share"])
+            self.assertAlmostEqual(
+                0.25, report["stages"]["transcribe"]["mean_real_time_factor"]
+            )
+            self.assertAlmostEqual(
+                2.0, report["stages"]["transcribe"]["cpu_utilization"]
+            )
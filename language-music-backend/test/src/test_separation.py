@@ -0,0 +1,156 @@
+import os.path
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from src.sound.utils import plan_separation_chunks
+
+try:
+    import torch
+    import torchaudio
+
+    from src.sound import separation
+    from src.sound.utils import CONVERTED_FILE_NAME, VOCALS_FILE_NAME
+except ImportError:
+    torch = None
+
+
+def _chunk_weights(length: int, segment: float, overlap: float, sample_rate: int):
+    # What the linear fades of torchaudio's Fade leave of each frame once the chunks are added together
+    weights = np.zeros(length)
+    for start, end, fade_in_len, fade_out_len in plan_separation_chunks(
+        length, segment, overlap, sample_rate
+    ):
+        chunk = np.ones(end - start)
+        chunk[:fade_in_len] = np.linspace(0, 1, fade_in_len)
+        if fade_out_len:
+            chunk[-fade_out_len:] = np.linspace(1, 0, fade_out_len)
+        weights[start:end] += chunk
+    return weights
+
+
+class ChunkPlanTest(unittest.TestCase):
+    def test_chunks_cover_the_song(self):
+        # 1100 frames per chunk, overlapping by 10
+        for length in [11, 500, 1099, 1100, 1101, 1500, 2195, 2205, 2200, 5000]:
+            chunks = plan_separation_chunks(length, 10, 0.1, 100)
+
+            self.assertEqual(0, chunks[0][0])
+            self.assertEqual(length, chunks[-1][1])
+            self.assertEqual(0, chunks[-1][3])
+            np.testing.assert_allclose(_chunk_weights(length, 10, 0.1, 100), 1.0)
+
+    def test_song_shorter_than_a_segment(self):
+        self.assertEqual([(0, 500, 0, 0)], plan_separation_chunks(500, 10, 0.1, 100))
+
+    def test_last_chunk_shorter(self):
+        chunks = plan_separation_chunks(2205, 10, 0.1, 100)
+
+        self.assertEqual(
+            [(0, 1100, 0, 10), (1090, 2200, 10, 10), (2190, 2205, 10, 0)], chunks
+        )
+
+
+class _ConvModel:
+    """
+    Stands in for HDemucs: a fixed convolution per source, so the output near the edges of a chunk depends on where
+    the chunk was cut, like the real model
+    """
+
+    sources = ["drums", "bass", "other", "vocals"]
+
+    def __init__(self):
+        generator = torch.Generator().manual_seed(0)
+        self.conv = torch.nn.Conv1d(
+            2, 2 * len(self.sources), kernel_size=9, padding="same"
+        )
+        with torch.no_grad():
+            self.conv.weight.copy_(
+                torch.randn(self.conv.weight.shape, generator=generator)
+            )
+            self.conv.bias.zero_()
+
+    def forward(self, mix: "torch.Tensor") -> "torch.Tensor":
+        batch, channels, length = mix.shape
+        return torch.tanh(self.conv(mix)).reshape(
+            batch, len(self.sources), channels, length
+        )
+
+
+@unittest.skipIf(torch is None, "torch is not installed")
+class SeparationTest(unittest.TestCase):
+    sample_rate = 44100
+
+    def setUp(self):
+        generator = torch.Generator().manual_seed(1)
+        # 25 seconds: three chunks of the separation, the last one shorter
+        self.waveform = 0.1 * torch.randn(2, 25 * self.sample_rate, generator=generator)
+        self.model = _ConvModel()
+
+    def test_streaming_matches_in_memory(self):
+        expected, _ = separation.separate_vocals(
+            self.waveform, self.sample_rate, model=self.model, batch_size=1
+        )
+
+        with tempfile.TemporaryDirectory() as working_dir:
+            torchaudio.save(
+                os.path.join(working_dir, CONVERTED_FILE_NAME),
+                self.waveform,
+                self.sample_rate,
+                encoding="PCM_F",
+                bits_per_sample=32,
+            )
+            # Blocks shorter than the chunks, so that chunks span several blocks
+            with mock.patch.object(separation, "STREAMING_READ_SECONDS", 7):
+                separation.extract_voice(working_dir, model=self.model, streaming=True)
+
+            actual, sample_rate = torchaudio.load(
+                os.path.join(working_dir, VOCALS_FILE_NAME)
+            )
+            self.assertFalse(
+                os.path.exists(os.path.join(working_dir, VOCALS_FILE_NAME + ".tmp"))
+            )
+
+        self.assertEqual(self.sample_rate, sample_rate)
+        self.assertEqual(expected.shape, actual.shape)
+        self.assertTrue(torch.allclose(expected, actual, atol=1e-4))
+
+    def test_batches_match_single_chunks(self):
+        separate_sources = getattr(separation, "__separate_sources")
+        mix = torch.randn(1, 2, 6550, generator=torch.Generator().manual_seed(2))
+
+        # Six chunks of 1 second at 1000Hz: the first one alone as it has no overlap before it, a batch of four,
+        # then the shorter last one alone
+        expected = separate_sources(
+            self.model, mix, segment=1.0, overlap=0.1, sample_rate=1000, batch_size=1
+        )
+        actual = separate_sources(
+            self.model, mix, segment=1.0, overlap=0.1, sample_rate=1000, batch_size=4
+        )
+
+        self.assertTrue(torch.allclose(expected, actual, atol=1e-5))
+
+    def test_streaming_failure_leaves_no_vocals(self):
+        model = _ConvModel()
+        calls = []
+
+        def fail_on_second_chunk(mix):
+            calls.append(mix)
+            if len(calls) > 1:
+                raise RuntimeError("out of memory")
+            return _ConvModel.forward(model, mix)
+
+        model.forward = fail_on_second_chunk
+
+        with tempfile.TemporaryDirectory() as working_dir:
+            torchaudio.save(
+                os.path.join(working_dir, CONVERTED_FILE_NAME),
+                self.waveform,
+                self.sample_rate,
+            )
+            with self.assertRaises(RuntimeError):
+                separation.extract_voice(working_dir, model=model, streaming=True)
+
+            self.assertEqual([CONVERTED_FILE_NAME], os.listdir(working_dir))
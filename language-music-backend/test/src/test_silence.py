@@ -0,0 +1,48 @@
+import unittest
+
+import numpy as np
+import pydub.silence
+
+from src.sound.silence import detect_nonsilent
+from src.sound.utils import convert_from_numpy, convert_to_numpy
+
+
+class SilenceTest(unittest.TestCase):
+    def test_same_ranges_as_pydub(self):
+        rng = np.random.default_rng(0)
+        sample_rate = 11025
+
+        # Alternate quiet and loud parts, some of them close to the threshold
+        parts = [
+            rng.normal(0, amplitude, (int(seconds * sample_rate), 2))
+            for seconds, amplitude in [
+                (1.3, 0.001),
+                (2.1, 0.3),
+                (1.7, 0.02),
+                (0.4, 0.05),
+                (2.5, 0.001),
+                (1.1, 0.03),
+            ]
+        ]
+        sound = convert_from_numpy(np.concatenate(parts), sample_rate)
+        samples, frame_rate = convert_to_numpy(sound)
+
+        for min_silence_len, silence_thresh in [(1000, -32), (500, -40), (300, -30)]:
+            self.assertEqual(
+                detect_nonsilent(
+                    samples,
+                    frame_rate,
+                    min_silence_len=min_silence_len,
+                    silence_thresh=silence_thresh,
+                ),
+                pydub.silence.detect_nonsilent(
+                    sound,
+                    min_silence_len=min_silence_len,
+                    silence_thresh=silence_thresh,
+                ),
+            )
+
+    def test_whole_sound_silent(self):
+        samples = np.zeros((8000 * 3, 1), dtype=np.float32)
+
+        self.assertEqual(detect_nonsilent(samples, 8000, min_silence_len=1000), [])
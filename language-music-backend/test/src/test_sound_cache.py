@@ -0,0 +1,52 @@
+import os.path
+import tempfile
+import unittest
+
+from src.sound.cache import StageCache
+
+
+class StageCacheTest(unittest.TestCase):
+    def test_skips_fresh_stages(self):
+        with tempfile.TemporaryDirectory() as working_dir:
+            runs = []
+
+            def write_output(content: str):
+                runs.append(content)
+                with open(os.path.join(working_dir, "output.txt"), "w") as f:
+                    f.write(content)
+
+            with open(os.path.join(working_dir, "input.txt"), "w") as f:
+                f.write("input")
+
+            def run_stage(content: str, params: dict):
+                StageCache(working_dir).run(
+                    "split",
+                    lambda: write_output(content),
+                    inputs=["input.txt"],
+                    outputs=["output.txt"],
+                    params=params,
+                )
+
+            run_stage("first", {"silence_thresh": -32})
+            run_stage("skipped", {"silence_thresh": -32})
+            self.assertEqual(runs, ["first"])
+
+            run_stage("new params", {"silence_thresh": -40})
+            self.assertEqual(runs, ["first", "new params"])
+
+            with open(os.path.join(working_dir, "input.txt"), "w") as f:
+                f.write("changed input")
+            run_stage("new input", {"silence_thresh": -40})
+            self.assertEqual(runs, ["first", "new params", "new input"])
+
+            os.remove(os.path.join(working_dir, "output.txt"))
+            run_stage("missing output", {"silence_thresh": -40})
+            self.assertEqual(len(runs), 4)
+
+            # Cut short by an interrupted run
+            with open(os.path.join(working_dir, "output.txt"), "w") as f:
+                f.write("missing")
+            run_stage("truncated output", {"silence_thresh": -40})
+            self.assertEqual(len(runs), 5)
+            run_stage("skipped", {"silence_thresh": -40})
+            self.assertEqual(len(runs), 5)
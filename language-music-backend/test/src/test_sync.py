@@ -1,12 +1,17 @@
 import json
 import unittest
 
+from thefuzz import fuzz
+
 from src.sync import (
     clean_lyrics,
     extract_known_passages,
     print_sync_stats_debug,
     sync_words,
+    TokenizedLyrics,
 )
+from src.sync.instrumentation import collect_sync_stats
+from src.sync.scoring import score_windows, SegmentScorer
 
 
 class SyncTest(unittest.TestCase):
@@ -51,6 +56,64 @@ class SyncTest(unittest.TestCase):
             )
             raise
 
+    def test_dp_alignment_covers_lyrics(self):
+        with open("test/data/sync/dom_andra/lyrics.txt", "r") as f:
+            lyrics = f.read()
+        with open("test/data/sync/dom_andra/transcription.json", "r") as f:
+            data = json.load(f)
+
+        just_lyrics = clean_lyrics(lyrics)
+        known_passages = extract_known_passages(
+            data["segments"], just_lyrics, mode="dp"
+        )
+
+        self.assertEqual(len(known_passages), len(data["segments"]))
+        for i in range(len(known_passages) - 1):
+            self.assertEqual(known_passages[i][1], known_passages[i + 1][0])
+        self.assertEqual(known_passages[0][0], 0)
+
+        # "Var att vi blev sångomandra, vi blev sångomandra, vi blev sångomandra"
+        self.assertEqual(known_passages[21], (132, 149))
+
+        synced_words = sync_words(known_passages, data["segments"], just_lyrics)
+        self.assertEqual(
+            len(just_lyrics.split()),
+            len([s for sync_list in synced_words for s in sync_list]),  # flatten
+        )
+
+    def test_tokenized_lyrics_join(self):
+        lyrics = "En ren  som kvinna\nsöker man"
+        tokenized = TokenizedLyrics.from_text(lyrics)
+
+        self.assertEqual(len(tokenized), len(lyrics.split()))
+        for start, end in [(0, 6), (1, 3), (5, 6), (3, 3), (4, 2), (2, 10)]:
+            self.assertEqual(
+                tokenized.join(start, end), " ".join(lyrics.split()[start:end])
+            )
+
+    def test_score_windows_matches_fuzz_ratio(self):
+        with open("test/data/sync/dom_andra/lyrics.txt", "r") as f:
+            lyrics = TokenizedLyrics.from_text(clean_lyrics(f.read()))
+        segment_text = "Var att vi blev sångomandra, vi blev sångomandra"
+
+        for window_size, start in [(1, 0), (5, 0), (7, 42), (12, len(lyrics) - 12)]:
+            scores = score_windows(lyrics, segment_text, window_size, start=start)
+
+            self.assertEqual(len(scores), len(lyrics) - window_size + 1 - start)
+            for i, score in enumerate(scores):
+                expected = fuzz.ratio(
+                    lyrics.join(start + i, start + i + window_size), segment_text
+                )
+                self.assertEqual(score, expected)
+
+        scorer = SegmentScorer(lyrics, segment_text)
+        scorer.score_windows(5, start=10)
+        for start, end in [(10, 15), (12, 17), (3, 8), (10, 16), (12, 12)]:
+            self.assertEqual(
+                scorer.score(start, end),
+                fuzz.ratio(lyrics.join(start, end), segment_text),
+            )
+
     def test_word_sync_perfect_match(self):
         one_segment = [
             {
@@ -180,6 +243,27 @@ class SyncTest(unittest.TestCase):
         self.assertEqual(synced_words[-1][-1][0], 120.28800000000001)
         self.assertEqual(synced_words[-1][-1][1], 120.86800000000001)
 
+    def test_word_searches_recorded_apart_from_segments(self):
+        one_segment = [
+            {
+                "start": 116.888,
+                "end": 120.868,
+                "text": " En drömmamma sömma fan",
+                "words": [
+                    {"text": "En", "start": 116.888, "end": 117.368},
+                    {"text": "drömmamma", "start": 117.368, "end": 119.208},
+                    {"text": "sömma", "start": 119.208, "end": 120.288},
+                    {"text": "fan", "start": 120.288, "end": 120.868},
+                ],
+            }
+        ]
+
+        with collect_sync_stats() as stats:
+            sync_words([(0, 6)], one_segment, "En dröm om mammas ömma famn")
+
+        self.assertEqual([], stats.windows_per_segment)
+        self.assertTrue(stats.windows_per_word)
+
     def test_words_sync_stt_more_words(self):
         one_segment = [
             {
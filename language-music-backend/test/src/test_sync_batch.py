@@ -0,0 +1,91 @@
+import json
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from src.sound.utils import LRC_FILE_NAME, TRANSCRIPTION_FILE_NAME
+from src.sync.batch import (
+    SYNC_ALL_PROGRESS_FILE_NAME,
+    SYNC_ALL_REPORT_FILE_NAME,
+    sync_all_songs,
+)
+
+
+class SyncAllSongsTest(unittest.TestCase):
+    def test_resume_interrupted_run(self):
+        with open("test/data/sync/dom_andra/lyrics.txt", "r") as f:
+            lyrics = f.read()
+
+        with tempfile.TemporaryDirectory() as songs_dir:
+            # "synced" has no transcription, it would fail if it were synced again
+            for youtube_id in ["synced", "failed", "cut_off", "no_lyrics"]:
+                os.makedirs(os.path.join(songs_dir, youtube_id))
+            for youtube_id in ["failed", "cut_off"]:
+                shutil.copy(
+                    "test/data/sync/dom_andra/transcription.json",
+                    os.path.join(songs_dir, youtube_id, TRANSCRIPTION_FILE_NAME),
+                )
+
+            # The previous run was killed while writing the result of "cut_off"
+            previous_results = [
+                {"youtube_id": "synced", "status": "ok", "seconds": 1.0, "error": None},
+                {
+                    "youtube_id": "failed",
+                    "status": "failed",
+                    "seconds": 1.0,
+                    "error": "RuntimeError()",
+                },
+            ]
+            cut_off_line = '{"youtube_id": "cut_off", "status": "o'
+            with open(os.path.join(songs_dir, SYNC_ALL_PROGRESS_FILE_NAME), "w") as f:
+                f.writelines(json.dumps(result) + "\n" for result in previous_results)
+                f.write(cut_off_line)
+
+            results = sync_all_songs(
+                {
+                    "synced": lyrics,
+                    "failed": lyrics,
+                    "cut_off": lyrics,
+                    "no_lyrics": None,
+                },
+                songs_dir=songs_dir,
+                workers=2,
+            )
+
+            status_by_song = {
+                result["youtube_id"]: result["status"] for result in results
+            }
+            self.assertEqual(
+                {"failed": "ok", "cut_off": "ok", "no_lyrics": "failed"},
+                status_by_song,
+            )
+            self.assertFalse(
+                os.path.exists(os.path.join(songs_dir, "synced", LRC_FILE_NAME))
+            )
+            for youtube_id in ["failed", "cut_off"]:
+                self.assertTrue(
+                    os.path.exists(os.path.join(songs_dir, youtube_id, LRC_FILE_NAME))
+                )
+
+            # The progress file becomes the report, the next run starts from scratch
+            self.assertFalse(
+                os.path.exists(os.path.join(songs_dir, SYNC_ALL_PROGRESS_FILE_NAME))
+            )
+            with open(os.path.join(songs_dir, SYNC_ALL_REPORT_FILE_NAME), "r") as f:
+                lines = f.read().splitlines()
+
+            self.assertEqual(
+                [json.dumps(result) for result in previous_results] + [cut_off_line],
+                lines[:3],
+            )
+            # The new results start on their own line, after the cut off one
+            self.assertEqual(results, [json.loads(line) for line in lines[3:]])
+            self.assertEqual(
+                "No lyrics found",
+                next(
+                    result["error"]
+                    for result in results
+                    if result["youtube_id"] == "no_lyrics"
+                ),
+            )
@@ -0,0 +1,91 @@
+import unittest
+
+import numpy as np
+
+from src.sound.utils import convert_from_numpy
+from src.sound.vad import detect_vocal_activity, refine_chunks
+
+
+def _voice(seconds: float, amplitude: float, sample_rate: int) -> np.ndarray:
+    # A vibrato on a few harmonics, peaky like a sung note
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 220 * (1 + 0.01 * np.sin(2 * np.pi * 5 * t))
+    voice = sum(np.sin(2 * np.pi * k * pitch * t) / k for k in range(1, 8))
+    return amplitude * voice / np.abs(voice).max()
+
+
+class VocalActivityTest(unittest.TestCase):
+    sample_rate = 16000
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+
+        def noise(seconds, amplitude):
+            return rng.normal(0, amplitude, int(seconds * self.sample_rate))
+
+        parts = [
+            noise(2, 0.001),
+            _voice(3, 0.3, self.sample_rate),
+            noise(0.4, 0.001),
+            _voice(2, 0.3, self.sample_rate),
+            noise(3, 0.001),
+            # Loud, but noise like the drums bleeding through the separation
+            noise(2, 0.1),
+            noise(2, 0.001),
+            _voice(1.5, 0.2, self.sample_rate),
+            noise(2, 0.001),
+        ]
+        self.samples = np.stack([np.concatenate(parts)] * 2, axis=1)
+
+    def test_voiced_ranges(self):
+        ranges = detect_vocal_activity(self.samples, self.sample_rate, padding=0)
+
+        self.assertEqual(2, len(ranges))
+        # The short gap between the first two notes is merged, the noise is skipped
+        for (start, end), (expected_start, expected_end) in zip(
+            ranges, [(2000, 7400), (14400, 15900)]
+        ):
+            self.assertAlmostEqual(expected_start, start, delta=40)
+            self.assertAlmostEqual(expected_end, end, delta=40)
+
+    def test_refined_chunks_keep_song_time(self):
+        sound = convert_from_numpy(self.samples, self.sample_rate)
+        chunks, timestamps = refine_chunks(
+            [sound[:10000], sound[10000:]], [(0, 10000), (10000, len(sound))]
+        )
+
+        self.assertEqual(2, len(chunks))
+        self.assertAlmostEqual(14100, timestamps[1][0], delta=40)
+        for chunk, (start, end) in zip(chunks, timestamps):
+            self.assertEqual(end - start, len(chunk))
+
+    def test_silence(self):
+        self.assertEqual(
+            [], detect_vocal_activity(np.zeros((16000, 2)), self.sample_rate)
+        )
+
+    def test_long_continuous_singing(self):
+        # Sung from start to end, the quietest frames are still the voice and cannot be the noise floor
+        t = np.arange(60 * self.sample_rate) / self.sample_rate
+        envelope = 1 + 0.3 * np.sin(2 * np.pi * 0.1 * t)
+        voice = _voice(60, 0.25, self.sample_rate) * envelope
+        samples = np.stack([voice] * 2, axis=1)
+
+        self.assertEqual(
+            [[0, 60000]],
+            detect_vocal_activity(samples, self.sample_rate, padding=0),
+        )
+
+        # Notes with short breaths, the breaths are merged
+        note = np.concatenate(
+            [
+                _voice(2.8, 0.3, self.sample_rate),
+                np.zeros(int(0.2 * self.sample_rate)),
+            ]
+        )
+        samples = np.stack([np.tile(note, 40)] * 2, axis=1)
+        sound = convert_from_numpy(samples, self.sample_rate)
+        chunks, timestamps = refine_chunks([sound], [(5000, 125000)])
+
+        # The whole split is kept, the padding covers the last breath
+        self.assertEqual([(5000, 125000)], timestamps)